@@ -3,44 +3,49 @@ from typing import List, Tuple
 import numpy as np
 import random
 import time
+import tsp_construction
 import tsp_general_functions
+import tsp_profiling
 
 
-def initial_solution(cities: List[City]) -> Tuple[List[City], float, float]:
+def initial_solution(cities: List[City], heuristic: str = 'nearest_neighbour') -> Tuple[List[City], float, float]:
     """
     Apply your constructive heuristic algorithm.
     :param cities: all cities to be visited
+    :param heuristic: 'nearest_neighbour', 'cheapest_insertion', which is slower but a better start for local search,
+    or 'hilbert', which only sorts the cities along a space filling curve and is the fastest
     :return: The path, the objective, the computation time
     """
     t0 = time.time()
 
     # vvvvvvv YOUR CODE HERE vvvvvvv
     # Hint: There are useful functions in the City class
-    path = [cities[0]]
-    unvisited_cities = set(cities[1:])
-    while len(path) != len(cities):
-        closest_city, distance = path[-1].closest_other_city(unvisited_cities)
-        path.append(closest_city)
-        unvisited_cities.remove(closest_city)
-
-    # path = [cities[0]]
-    # unvisited_cities = set(cities[1:])
-    # while len(path) != len(cities):
-    #     extra_dist = np.inf
-    #     best_city = None
-    #     best_index = None
-    #     for city in unvisited_cities:
-    #         insertion_position, extra_dist_insertion = city.best_insertion_position(path)
-    #         if extra_dist_insertion < extra_dist:
-    #             extra_dist = extra_dist_insertion
-    #             best_city = city
-    #             best_index = insertion_position
-    #     path.insert(best_index, best_city)
-    #     unvisited_cities.remove(best_city)
+    if heuristic == 'nearest_neighbour':
+        # Nearest neighbour, vectorized over the remaining cities. Equivalent to
+        # path = [cities[0]]
+        # unvisited_cities = set(cities[1:])
+        # while len(path) != len(cities):
+        #     closest_city, distance = path[-1].closest_other_city(unvisited_cities)
+        #     path.append(closest_city)
+        #     unvisited_cities.remove(closest_city)
+        path = tsp_construction.nearest_neighbour_path(cities)
+    elif heuristic == 'cheapest_insertion':
+        # Insert the city with the cheapest City.best_insertion_position until all cities are on the path, with the
+        # insertion costs cached between iterations
+        path = tsp_construction.cheapest_insertion_path(cities)
+    elif heuristic == 'hilbert':
+        path = tsp_construction.hilbert_path(cities)
+    else:
+        raise ValueError(f"Unknown heuristic {heuristic}")
 
     total_distance = tsp_general_functions.path_length(path)
     # ^^^^^^ YOUR CODE HERE ^^^^^^^
 
     t_total = time.time() - t0
+    stats = tsp_profiling.current()
+    if stats is not None:
+        stats.count('constructions')
+        stats.timers['construction'] += t_total
+        stats.log('initial_solution', heuristic=heuristic, length=total_distance, seconds=t_total)
 
     return path, total_distance, t_total
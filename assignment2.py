@@ -1,31 +1,134 @@
-from tsp_classes import City
-from typing import List, Tuple
+from tsp_classes import City, CityArray
+from typing import List, Optional, Tuple
 import numpy as np
 import random
 import time
+from concurrent.futures import ProcessPoolExecutor
+import tsp_construction
 import tsp_general_functions
+import tsp_local_search
+import tsp_profiling
+from tsp_spatial import SpatialGrid
 
 
-def grasp_nearest_neighbour(cities: List[City], iterations=20, fraction_of_best=1.2):
+def grasp_order(coordinates: np.ndarray, fraction_of_best: float, rng: random.Random,
+                spatial_index: bool = False, priority: Optional[np.ndarray] = None) -> Tuple[np.ndarray, float]:
+    """
+    One GRASP iteration on a coordinate array. Candidates are considered in the order of priority, with the priority of
+    tsp_construction.set_order() and the same random state the result equals that of grasp_nearest_neighbour.
+    :param coordinates: Array with the x and y coordinate of each city
+    :param fraction_of_best: The fraction for which cities are accepted
+    :param rng: The random number generator that selects among the candidates
+    :param spatial_index: Query the candidate cities from a SpatialGrid instead of computing all distances
+    :param priority: The indices of the cities in the order in which candidates are considered, by default in order of
+    their index. Not used with a spatial index
+    :return: The indices of the cities in the order in which they are visited and the path length
+    """
+    num_cities = len(coordinates)
+    order = np.empty(num_cities, dtype=np.intp)
+    order[0] = 0
+    total_distance = 0
+    grid = None
+    distance_evaluations = 0
+    if spatial_index:
+        grid = SpatialGrid(CityArray(coordinates))
+        grid.remove(0)
+    elif priority is None:
+        unvisited = np.arange(1, num_cities)
+    else:
+        priority = np.asarray(priority, dtype=np.intp)
+        unvisited = priority[priority != 0]
+    for step in range(1, num_cities):
+        x, y = coordinates[order[step - 1]]
+        if grid is not None:
+            _, closest_distance = grid.nearest(x, y)
+            options, distances = grid.within(x, y, fraction_of_best * closest_distance[0])
+        else:
+            distances = np.sqrt((coordinates[unvisited, 0] - x) ** 2 + (coordinates[unvisited, 1] - y) ** 2)
+            distance_evaluations += len(distances)
+            accepted = distances <= fraction_of_best * distances.min()
+            options, distances = unvisited[accepted], distances[accepted]
+        chosen = rng.randint(0, len(options) - 1)
+        order[step] = options[chosen]
+        total_distance += distances[chosen]
+        if grid is not None:
+            grid.remove(int(options[chosen]))
+        else:
+            unvisited = unvisited[unvisited != options[chosen]]
+
+    # Connect the last and first city
+    total_distance += np.sqrt(((coordinates[order[-1]] - coordinates[order[0]]) ** 2).sum())
+    stats = tsp_profiling.current()
+    if stats is not None:
+        if grid is not None:
+            distance_evaluations += grid.distance_evaluations
+        # The closing arc is the one distance computed outside of the loop
+        stats.count('distance_evaluations', distance_evaluations + 1)
+    return order, total_distance
+
+
+# Coordinates and settings shared with the GRASP worker processes, set once per worker by _init_grasp_worker
+_worker_state = {}
+
+
+def _init_grasp_worker(coordinates: np.ndarray, fraction_of_best: float, spatial_index: bool):
+    _worker_state['coordinates'] = coordinates
+    _worker_state['fraction_of_best'] = fraction_of_best
+    _worker_state['spatial_index'] = spatial_index
+
+
+def _grasp_worker(seed: int) -> Tuple[np.ndarray, float]:
+    order, length = grasp_order(_worker_state['coordinates'], _worker_state['fraction_of_best'],
+                                random.Random(seed), _worker_state['spatial_index'])
+    # Send back compact indices instead of City objects
+    return order.astype(np.int32), length
+
+
+def grasp_nearest_neighbour(cities: List[City], iterations=20, fraction_of_best=1.2, spatial_index=False,
+                            processes=None, seed=None):
     """
     Extend the nearest neighbour heuristic with GRASP. Select one city no further than fraction_of_best * d_closest city
     :param cities: all cities to be visited
     :param iterations: The number of GRASP iterations
     :param fraction_of_best: The fraction for which cities are accepted
+    :param spatial_index: Query the candidate cities from a SpatialGrid instead of computing all distances
+    :param processes: If given, spread the iterations over this many worker processes. Each iteration then gets its
+    own random seed derived from seed, so the result does not depend on the number of processes or the global random
+    state
+    :param seed: Seed for the iterations when processes is given
     :return: The path, the objective, the computation time
     """
     t0 = time.time()
+    stats = tsp_profiling.current()
+    if processes is not None:
+        order, best_objective = _parallel_grasp(CityArray.from_cities(cities).coordinates, iterations,
+                                                fraction_of_best, spatial_index, processes, seed)
+        if stats is not None:
+            stats.count('grasp_iterations', iterations)
+            stats.log('grasp', iterations=iterations, processes=processes, length=best_objective,
+                      seconds=time.time() - t0)
+        return [cities[index] for index in order.tolist()], best_objective, time.time() - t0
+
     best_path = None
     best_objective = np.inf
-    for _ in range(iterations):
+    if spatial_index:
+        positions = {city: index for index, city in enumerate(cities)}
+    for iteration in range(iterations):
         # Repeat for all iterations
+        t_iteration = time.time()
         path = [cities[0]]
         total_distance = 0
         unvisited_cities = set(cities[1:])
+        grid = None
+        if spatial_index:
+            # The grid holds exactly the unvisited cities
+            grid = SpatialGrid(cities)
+            grid.remove(0)
         while len(unvisited_cities) > 0:
             # Continue until all cities are visited
             # Find the extra distance to each unvisited city and the distance to the closest city
-            extra_distances, best_extra_distance = path[-1].closest_other_city_dict(unvisited_cities)
+            extra_distances, best_extra_distance = path[-1].closest_other_city_dict(unvisited_cities, grid,
+                                                                                    fraction_of_best)
             # Consider all cities that are within fraction_of_best * best_extra_distance distance
             options = [city for city, extra_distance in extra_distances.items()
                        if extra_distance <= fraction_of_best * best_extra_distance]
@@ -35,6 +138,8 @@ def grasp_nearest_neighbour(cities: List[City], iterations=20, fraction_of_best=
             path.append(chosen_city)
             total_distance += extra_distances[chosen_city]
             unvisited_cities.remove(chosen_city)
+            if grid is not None:
+                grid.remove(positions[chosen_city])
 
         # Calculate the path length by connecting the last and first city
         total_distance += path[-1].distance_to(path[0])
@@ -42,48 +147,124 @@ def grasp_nearest_neighbour(cities: List[City], iterations=20, fraction_of_best=
             # If the obtained path is the best one so far remember it
             best_objective = total_distance
             best_path = path
+        if stats is not None:
+            stats.count('grasp_iterations')
+            stats.log('grasp_iteration', iteration=iteration, length=total_distance, seconds=time.time() - t_iteration)
 
     t_total = time.time() - t0
 
     return best_path, best_objective, t_total
 
 
-def local_search(cities: List[City], grasp_iterations=20, fraction_of_best=1.2):
+def _parallel_grasp(coordinates: np.ndarray, iterations: int, fraction_of_best: float, spatial_index: bool,
+                    processes: int, seed=None) -> Tuple[np.ndarray, float]:
+    """
+    Run the GRASP iterations in a process pool
+    :return: The best order of the cities and its length
+    """
+    # One independent, deterministic seed per iteration
+    seeds = [int(sequence.generate_state(1)[0]) for sequence in np.random.SeedSequence(seed).spawn(iterations)]
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_grasp_worker,
+                                 initargs=(coordinates, fraction_of_best, spatial_index)) as executor:
+            results = list(executor.map(_grasp_worker, seeds, chunksize=max(1, iterations // (4 * processes))))
+    else:
+        _init_grasp_worker(coordinates, fraction_of_best, spatial_index)
+        results = [_grasp_worker(iteration_seed) for iteration_seed in seeds]
+
+    # The first iteration wins a tie, such that the result is deterministic
+    best_order, best_objective = min(results, key=lambda result: result[1])
+    return best_order, best_objective
+
+
+def local_search(cities: List[City], grasp_iterations=20, fraction_of_best=1.2, method='exhaustive',
+                 max_segment_length=3, neighbours=None, initial_path=None, lk_depth=5, construction='grasp'):
     """
     Apply local search to improve the solution obtained with GRASP
     :param cities: all cities to be visited
     :param grasp_iterations: The number of GRASP iterations
     :param fraction_of_best: The fraction for which cities are accepted
+    :param method: 'exhaustive' re-inserts every segment at every position for up to 50 sweeps,
+    'or_opt' applies Or-opt and 2-opt moves with delta evaluation and don't look bits, which scales to large instances,
+    'vnd' searches the 2-opt and Or-opt neighbourhoods one after the other (variable neighbourhood descent) and 'lk'
+    adds Lin-Kernighan moves of depth lk_depth as a last neighbourhood
+    :param max_segment_length: The longest segment that is moved by the 'or_opt', 'vnd' and 'lk' methods
+    :param neighbours: Restrict the 'or_opt', 'vnd' and 'lk' methods to moves that connect a city to one of its k
+    nearest neighbours. The 'lk' method uses 8 neighbours if None
+    :param initial_path: Improve this path instead of the one obtained with GRASP
+    :param lk_depth: The maximum number of 2-opt moves in a Lin-Kernighan move of the 'lk' method
+    :param construction: 'grasp' starts from grasp_nearest_neighbour, 'hilbert' from the much faster but longer path
+    along a Hilbert curve (tsp_construction.hilbert_path). Not used with an initial_path
     :return: The path, the objective, the computation time
     """
     t0 = time.time()
-    path, length, time_initial = grasp_nearest_neighbour(cities, grasp_iterations, fraction_of_best)
+    stats = tsp_profiling.current()
+    if initial_path is None and construction == 'hilbert':
+        path = tsp_construction.hilbert_path(cities)
+        length = tsp_general_functions.path_length(path)
+    elif initial_path is None and construction == 'grasp':
+        path, length, time_initial = grasp_nearest_neighbour(cities, grasp_iterations, fraction_of_best)
+    elif initial_path is None:
+        raise ValueError(f"Unknown construction {construction}, use 'grasp' or 'hilbert'")
+    else:
+        path, length = list(initial_path), tsp_general_functions.path_length(initial_path)
+    t_construction = time.time() - t0
 
     # vvvvvvv YOUR CODE HERE vvvvvvv
     # Hint: You might want to use the function tsp_general_functions.re_insert_path_segment(...)
-    for _ in range(50):
-        best_length = length
-        best_path = path.copy()
-        # You could also shorten the for loops
-        for i in range(len(path)):
-        # i = 0
-            for j in range(i+1, len(path)):
-            # j = i + 1 (The larger j the longer the path segment that you place at another position)
-                for insert_left_index in range(len(path) - (j - i + 1)):
-                # insert_left_index = 0 (If j=0 we place the segment in front)
-                    for reverse in [True, False]:
-                    # reverse = False
-                        new_path, new_length = tsp_general_functions.re_insert_path_segment(
-                            (i, j), insert_left_index, reverse, path, length)
-                        if new_length < best_length - 0.0001:
-                            best_length = new_length
-                            best_path = new_path
-        path = best_path
-        length = best_length
+    if method == 'or_opt':
+        order, length = tsp_local_search.improve_order(CityArray.from_cities(cities).coordinates,
+                                                       tsp_general_functions.path_indices(path, cities),
+                                                       max_segment_length, neighbours=neighbours)
+        path = [cities[index] for index in order.tolist()]
+    elif method in ('vnd', 'lk'):
+        if method == 'lk' and neighbours is None:
+            neighbours = 8
+        order, length = tsp_local_search.improve_order_vnd(CityArray.from_cities(cities).coordinates,
+                                                           tsp_general_functions.path_indices(path, cities),
+                                                           max_segment_length, neighbours,
+                                                           lk_depth if method == 'lk' else 0)
+        path = [cities[index] for index in order.tolist()]
+    elif method == 'exhaustive':
+        for sweep in range(50):
+            best_length = length
+            best_move = None
+            moves_evaluated = 0
+            # You could also shorten the for loops
+            for i in range(len(path)):
+            # i = 0
+                for j in range(i+1, len(path)):
+                # j = i + 1 (The larger j the longer the path segment that you place at another position)
+                    for insert_left_index in range(len(path) - (j - i + 1)):
+                    # insert_left_index = 0 (If j=0 we place the segment in front)
+                        for reverse in [True, False]:
+                        # reverse = False
+                            # Only the length is computed here, the new path is built for the best move of the sweep
+                            new_length = tsp_general_functions.re_insert_path_segment_length(
+                                (i, j), insert_left_index, reverse, path, length)
+                            moves_evaluated += 1
+                            if new_length < best_length - tsp_local_search.IMPROVEMENT_THRESHOLD:
+                                best_length = new_length
+                                best_move = ((i, j), insert_left_index, reverse)
+            if stats is not None:
+                stats.count('moves_evaluated', moves_evaluated)
+                stats.count('moves_accepted', int(best_move is not None))
+                stats.log('local_search_sweep', sweep=sweep, moves_evaluated=moves_evaluated,
+                          moves_accepted=int(best_move is not None), length=best_length)
+            if best_move is None:
+                # No improving move left, more sweeps would not change the path
+                break
+            path, length = tsp_general_functions.re_insert_path_segment(*best_move, path, length)
+    else:
+        raise ValueError(f"Unknown local search method {method}")
 
     total_distance = length
     # ^^^^^^ YOUR CODE HERE ^^^^^^^
 
     t_total = time.time() - t0
+    if stats is not None:
+        stats.timers['construction'] += t_construction
+        stats.timers['improvement'] += t_total - t_construction
+        stats.log('local_search', method=method, length=total_distance, construction_seconds=t_construction,
+                  improvement_seconds=t_total - t_construction)
     return path, total_distance, t_total
-
@@ -0,0 +1,216 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import assignment1_solutions
+import assignment2
+import tsp_construction
+import tsp_general_functions
+import tsp_io
+import tsp_local_search
+from tsp_classes import City, CityArray
+
+INSTANCE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instances')
+DEFAULT_SIZES = (10, 100, 1000, 10000, 50000)
+
+
+def _grasp(cities: List[City]) -> Tuple[List[City], float, float]:
+    # A fixed seed keeps the runs comparable between versions
+    return assignment2.grasp_nearest_neighbour(cities, iterations=5, spatial_index=True, processes=1, seed=0)
+
+
+def _local_search(cities: List[City], initial_path: List[City]) -> Tuple[List[City], float, float]:
+    return assignment2.local_search(cities, method='or_opt', neighbours=8, initial_path=initial_path)
+
+
+# The solvers that are timed separately. local_search starts from the path found by grasp_nearest_neighbour, so its
+# runtime does not include the construction
+SOLVERS: Dict[str, Callable] = {
+    'initial_solution': assignment1_solutions.initial_solution,
+    'grasp_nearest_neighbour': _grasp,
+    'local_search': _local_search,
+}
+
+
+def _version() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure(solver: Callable, *args, memory: bool = True) -> Tuple[List[City], float, float, Optional[int]]:
+    """
+    Run a solver and measure its runtime and, in a second run under tracemalloc, its peak memory
+    :return: The path, its length, the runtime in seconds and the peak memory in bytes
+    """
+    t0 = time.perf_counter()
+    path, length, _ = solver(*args)
+    runtime = time.perf_counter() - t0
+
+    peak_memory = None
+    if memory:
+        # tracemalloc slows down allocations, so the memory is measured in a separate run
+        tracemalloc.start()
+        solver(*args)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return path, length, runtime, peak_memory
+
+
+def benchmark_instance(name: str, cities: List[City], optimum: Optional[float] = None, seed: Optional[int] = None,
+                       solvers: Sequence[str] = tuple(SOLVERS), memory: bool = True) -> List[dict]:
+    """
+    Time the solvers on one instance
+    :param name: Name of the instance in the results
+    :param cities: all cities to be visited
+    :param optimum: The known optimal path length, if any
+    :param seed: The seed with which the instance was created, if any
+    :param solvers: Names of the solvers in SOLVERS to run
+    :param memory: Measure the peak memory of each solver
+    :return: One result per solver
+    """
+    results = []
+    grasp_path = None
+    for solver_name in solvers:
+        if solver_name == 'local_search':
+            if grasp_path is None:
+                grasp_path, _, _ = _grasp(cities)
+            path, length, runtime, peak_memory = _measure(SOLVERS[solver_name], cities, grasp_path, memory=memory)
+        else:
+            path, length, runtime, peak_memory = _measure(SOLVERS[solver_name], cities, memory=memory)
+            if solver_name == 'grasp_nearest_neighbour':
+                grasp_path = path
+
+        order = tsp_general_functions.path_indices(path, cities)
+        results.append({
+            'instance': name,
+            'num_cities': len(cities),
+            'seed': seed,
+            'solver': solver_name,
+            'runtime': runtime,
+            'peak_memory': peak_memory,
+            'length': float(length),
+            'valid': sorted(order.tolist()) == list(range(len(cities))),
+            'optimum': optimum,
+            'gap': None if optimum is None else float(length) / optimum - 1,
+        })
+    return results
+
+
+def run_benchmarks(sizes: Sequence[int] = DEFAULT_SIZES, seeds: Sequence[int] = (1,),
+                   instance_files: Optional[Sequence[str]] = None, solvers: Sequence[str] = tuple(SOLVERS),
+                   memory: bool = True, verbose: bool = True) -> List[dict]:
+    """
+    Benchmark the solvers on random instances from start_up and on TSPLIB instances
+    :param sizes: The numbers of cities of the random instances
+    :param seeds: The seeds of the random instances
+    :param instance_files: TSPLIB files, by default the instances bundled in the instances directory. Known optima
+    are read from optima.json in the same directory
+    :param solvers: Names of the solvers in SOLVERS to run
+    :param memory: Measure the peak memory of each solver
+    :param verbose: Print each result
+    :return: All results
+    """
+    if instance_files is None:
+        instance_files = sorted(glob.glob(os.path.join(INSTANCE_DIRECTORY, '*.tsp')))
+
+    instances = []
+    for num_cities in sizes:
+        for seed in seeds:
+            cities, _ = tsp_general_functions.start_up(num_cities, as_array=True, seed=seed)
+            instances.append((f'start_up_{num_cities}', cities, None, seed))
+    for file_name in instance_files:
+        optima_file = os.path.join(os.path.dirname(file_name), 'optima.json')
+        optima = {}
+        if os.path.exists(optima_file):
+            with open(optima_file) as file:
+                optima = json.load(file)
+        name = os.path.splitext(os.path.basename(file_name))[0]
+        cities, _ = tsp_io.read_tsplib(file_name)
+        instances.append((name, cities, optima.get(name), None))
+
+    version = _version()
+    results = []
+    for name, cities, optimum, seed in instances:
+        for result in benchmark_instance(name, cities, optimum, seed, solvers, memory):
+            result['version'] = version
+            results.append(result)
+            if verbose:
+                gap = '' if result['gap'] is None else f"  gap={100 * result['gap']:6.2f}%"
+                print(f"{result['instance']:>16} {result['solver']:>24}  n={result['num_cities']:<6} "
+                      f"time={result['runtime']:8.3f}s  length={result['length']:12.1f}{gap}")
+    return results
+
+
+def write_results(results: List[dict], file_name: str):
+    """
+    Write benchmark results to a .csv or .json file
+    :param results: The results of run_benchmarks
+    :param file_name: The output file, the extension selects the format
+    """
+    if file_name.endswith('.json'):
+        with open(file_name, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        with open(file_name, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def candidate_list_benchmark(num_cities: int,
+                             neighbours: Sequence[Optional[int]] = (3, 5, 8, 10, 15, None)) -> List[dict]:
+    """
+    Compare the Or-opt local search restricted to the k nearest neighbours with the unrestricted search, starting
+    from the same nearest neighbour path
+    :param num_cities: The number of cities created by start_up
+    :param neighbours: The values of k to try, None is the unrestricted search
+    :return: For each k the path length, the gap with the unrestricted search and the computation time
+    """
+    cities, _ = tsp_general_functions.start_up(num_cities, as_array=True)
+    coordinates = CityArray.from_cities(cities).coordinates
+    initial_order = tsp_construction.nearest_neighbour_order(coordinates, spatial_index=True)
+
+    results = []
+    for k in neighbours:
+        t0 = time.time()
+        _, length = tsp_local_search.improve_order(coordinates, initial_order, neighbours=k)
+        results.append({'num_cities': num_cities, 'neighbours': k, 'length': length, 'time': time.time() - t0})
+
+    # Compare with the unrestricted search, or with the best k if it is not part of the run
+    reference = min(result['length'] for result in results if result['neighbours'] is None or None not in neighbours)
+    for result in results:
+        result['gap'] = result['length'] / reference - 1
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the TSP solvers without opening any windows')
+    parser.add_argument('--sizes', type=int, nargs='*', default=list(DEFAULT_SIZES),
+                        help='numbers of cities of the random start_up instances')
+    parser.add_argument('--seeds', type=int, nargs='*', default=[1], help='seeds of the random instances')
+    parser.add_argument('--instances', nargs='*', default=None,
+                        help='TSPLIB files, by default the files in the instances directory')
+    parser.add_argument('--solvers', nargs='*', default=list(SOLVERS), choices=list(SOLVERS))
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory measurement')
+    parser.add_argument('--output', default='benchmark_results.csv', help='.csv or .json file for the results')
+    parser.add_argument('--candidate-lists', type=int, metavar='NUM_CITIES',
+                        help='only compare the local search for several candidate list sizes')
+    arguments = parser.parse_args()
+
+    if arguments.candidate_lists:
+        for result in candidate_list_benchmark(arguments.candidate_lists):
+            print(f"k={str(result['neighbours']):>4}  length={result['length']:10.1f}  "
+                  f"gap={100 * result['gap']:6.2f}%  time={result['time']:.2f}s")
+    else:
+        all_results = run_benchmarks(arguments.sizes, arguments.seeds, arguments.instances, arguments.solvers,
+                                     not arguments.no_memory)
+        write_results(all_results, arguments.output)
@@ -8,6 +8,8 @@ cities, G = tsp_general_functions.start_up(NUM_CITIES)
 # If you need to, you could make changes here, do not update the output variable names
 path, length, comp_time = assignment1.initial_solution(cities)
 # path, length, comp_time = assignment2.local_search(cities, grasp_iterations=20, fraction_of_best=1.2)
+# import tsp_solver  # optimal for up to tsp_solver.EXACT_MAX_CITIES cities
+# path, length, comp_time = tsp_solver.solve(cities)
 
 # vvvvvv DON'T TOUCH THESE LINES IF YOU WANT TO FOLLOW THE ASSIGNMENT vvvvvvvv
 tsp_general_functions.evaluate_path(path, cities, length)
@@ -0,0 +1,226 @@
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import hashlib
+import json
+import sqlite3
+import time
+import numpy as np
+
+import assignment1_solutions
+import assignment2
+import tsp_construction
+import tsp_general_functions
+from tsp_classes import City, CityArray
+
+# Solvers whose results can be cached, local_search also accepts a warm start
+SOLVERS = {
+    'initial_solution': assignment1_solutions.initial_solution,
+    'local_search': assignment2.local_search,
+}
+
+
+def instance_fingerprint(coordinates: np.ndarray) -> str:
+    """
+    Stable hash of the coordinates of an instance, the same cities in the same order give the same fingerprint
+    :param coordinates: Array with the x and y coordinate of each city
+    :return: Hexadecimal sha256 digest
+    """
+    coordinates = np.ascontiguousarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    digest = hashlib.sha256(str(coordinates.shape).encode())
+    digest.update(coordinates.tobytes())
+    return digest.hexdigest()
+
+
+def parameter_fingerprint(solver: str, parameters: dict) -> str:
+    """
+    Stable hash of a solver and its parameters
+    :param solver: Name of the solver
+    :param parameters: Keyword arguments of the solver, the values should have a stable repr
+    :return: Hexadecimal sha256 digest
+    """
+    text = json.dumps([solver, sorted((key, repr(value)) for key, value in parameters.items())])
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _match_cities(cached_coordinates: np.ndarray, coordinates: np.ndarray) -> np.ndarray:
+    """
+    Find the cities of a cached instance in a new instance by their coordinates
+    :return: For each cached city the index of a city at the same location in the new instance, or -1. Every city of
+    the new instance is matched at most once
+    """
+    # Compare the locations as complex numbers, which sort on x and then on y
+    cached = np.ascontiguousarray(cached_coordinates, dtype=np.float64).reshape(-1, 2).view(np.complex128).ravel()
+    new = np.ascontiguousarray(coordinates, dtype=np.float64).reshape(-1, 2).view(np.complex128).ravel()
+    sorter = np.argsort(new, kind='stable')
+    found = np.minimum(np.searchsorted(new[sorter], cached), len(new) - 1)
+    matches = np.where(new[sorter][found] == cached, sorter[found], -1)
+    # Cities at the same location in the cached instance would all match the same new city, keep the first one
+    matched = np.flatnonzero(matches >= 0)
+    _, first = np.unique(matches[matched], return_index=True)
+    unique_matches = np.full(len(cached), -1, dtype=np.intp)
+    unique_matches[matched[first]] = matches[matched[first]]
+    return unique_matches
+
+
+class SolutionCache:
+    def __init__(self, max_entries: int = 128, file_name: Optional[str] = None, min_overlap: float = 0.9,
+                 max_candidates: int = 8):
+        """
+        Cache of solved instances keyed by the fingerprint of the coordinates and of the solver parameters. Recently
+        used solutions are kept in memory, all solutions are also stored in an sqlite database if a file is given.
+        :param max_entries: The number of solutions kept in memory
+        :param file_name: sqlite database for the on-disk layer, None for a memory only cache
+        :param min_overlap: A cached instance is used as a warm start for local_search if at least this fraction of
+        the cities of the larger of the two instances is in both
+        :param max_candidates: The number of most recently stored instances that are compared on a miss
+        """
+        self.max_entries = max_entries
+        self.min_overlap = min_overlap
+        self.max_candidates = max_candidates
+        # (instance key, parameter key) -> (coordinates, order, length)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.warm_starts = 0
+        self.misses = 0
+        self.connection = None
+        if file_name is not None:
+            self.connection = sqlite3.connect(file_name)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS solutions (instance_key TEXT, parameter_key TEXT, '
+                                    'num_cities INTEGER, coordinates BLOB, tour BLOB, length REAL, '
+                                    'PRIMARY KEY (instance_key, parameter_key))')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS solutions_by_size '
+                                    'ON solutions (parameter_key, num_cities)')
+            self.connection.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _remember(self, key: Tuple[str, str], entry: Tuple[np.ndarray, np.ndarray, float]):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, instance_key: str, parameter_key: str) -> Optional[Tuple[np.ndarray, float]]:
+        """
+        Look up the solution of an instance
+        :return: The order of the cities and the path length, or None
+        """
+        key = (instance_key, parameter_key)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            _, order, length = self.entries[key]
+            return order, length
+        if self.connection is not None:
+            row = self.connection.execute('SELECT coordinates, tour, length FROM solutions '
+                                          'WHERE instance_key = ? AND parameter_key = ?', key).fetchone()
+            if row is not None:
+                entry = (np.frombuffer(row[0], dtype=np.float64).reshape(-1, 2),
+                         np.frombuffer(row[1], dtype=np.int64).astype(np.intp), row[2])
+                self._remember(key, entry)
+                return entry[1], entry[2]
+        return None
+
+    def put(self, coordinates: np.ndarray, parameter_key: str, order: np.ndarray, length: float):
+        """
+        Store the solution of an instance
+        :param coordinates: Array with the x and y coordinate of each city
+        :param parameter_key: Fingerprint of the solver and its parameters
+        :param order: Indices of the cities in the order in which they are visited
+        :param length: The path length
+        """
+        coordinates = np.ascontiguousarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        order = np.asarray(order, dtype=np.intp)
+        key = (instance_fingerprint(coordinates), parameter_key)
+        self._remember(key, (coordinates, order, float(length)))
+        if self.connection is not None:
+            self.connection.execute('INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?, ?)',
+                                    (*key, len(coordinates), coordinates.tobytes(),
+                                     order.astype(np.int64).tobytes(), float(length)))
+            self.connection.commit()
+
+    def _candidates(self, parameter_key: str, num_cities: int):
+        """
+        The max_candidates most recently used or stored instances with the same parameters whose size allows the
+        minimum overlap
+        """
+        min_cities, max_cities = num_cities * self.min_overlap, num_cities / max(self.min_overlap, 1e-9)
+        num_candidates = 0
+        for (_, entry_parameter_key), (coordinates, order, _) in reversed(self.entries.items()):
+            if num_candidates == self.max_candidates:
+                return
+            if entry_parameter_key == parameter_key and min_cities <= len(coordinates) <= max_cities:
+                num_candidates += 1
+                yield coordinates, order
+        if self.connection is None:
+            return
+        # Select the keys through the index first, only the blobs of the chosen instances are read. A replaced row
+        # gets a new rowid, so the highest rowids are the most recently stored instances
+        instance_keys = self.connection.execute('SELECT instance_key FROM solutions '
+                                                'WHERE parameter_key = ? AND num_cities BETWEEN ? AND ? '
+                                                'ORDER BY rowid DESC', (parameter_key, min_cities, max_cities))
+        instance_keys = [instance_key for instance_key, in instance_keys
+                         if (instance_key, parameter_key) not in self.entries]
+        for instance_key in instance_keys[:self.max_candidates - num_candidates]:
+            coordinates, order = self.connection.execute('SELECT coordinates, tour FROM solutions '
+                                                         'WHERE instance_key = ? AND parameter_key = ?',
+                                                         (instance_key, parameter_key)).fetchone()
+            yield np.frombuffer(coordinates, dtype=np.float64).reshape(-1, 2), \
+                np.frombuffer(order, dtype=np.int64).astype(np.intp)
+
+    def warm_start(self, coordinates: np.ndarray, parameter_key: str) -> Optional[np.ndarray]:
+        """
+        Build a path for an instance from the cached solution of the most similar instance: the cities of that
+        solution that are in the instance keep their order and the other cities are inserted where they add the least
+        length
+        :param coordinates: Array with the x and y coordinate of each city
+        :param parameter_key: Fingerprint of the solver and its parameters
+        :return: The order of the cities, or None if no cached instance overlaps enough
+        """
+        num_cities = len(coordinates)
+        best_order, best_overlap = None, 0
+        for cached_coordinates, cached_order in self._candidates(parameter_key, num_cities):
+            matches = _match_cities(cached_coordinates, coordinates)
+            overlap = int((matches >= 0).sum())
+            if overlap >= self.min_overlap * max(num_cities, len(cached_coordinates)) and overlap > best_overlap:
+                # The cached path restricted to the cities that are still there
+                order = matches[cached_order]
+                best_order, best_overlap = order[order >= 0], overlap
+        if best_order is None:
+            return None
+        missing = np.setdiff1d(np.arange(num_cities), best_order)
+        return tsp_construction.insert_cities(coordinates, best_order, missing)
+
+    def solve(self, solver: str, cities: List[City], **parameters) -> Tuple[List[City], float, float]:
+        """
+        Solve an instance with one of SOLVERS, unless the solution is cached. On a miss local_search starts from the
+        cached path of a similar instance if there is one.
+        :param solver: 'initial_solution' or 'local_search'
+        :param cities: all cities to be visited
+        :param parameters: Keyword arguments of the solver
+        :return: The path, the objective, the computation time
+        """
+        t0 = time.time()
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver {solver}, use one of {', '.join(SOLVERS)}")
+        coordinates = CityArray.from_cities(cities).coordinates
+        parameter_key = parameter_fingerprint(solver, parameters)
+        cached = self.get(instance_fingerprint(coordinates), parameter_key)
+        if cached is not None:
+            self.hits += 1
+            order, length = cached
+            return [cities[index] for index in order.tolist()], length, time.time() - t0
+
+        order = None
+        if solver == 'local_search' and 'initial_path' not in parameters:
+            order = self.warm_start(coordinates, parameter_key)
+        if order is not None:
+            self.warm_starts += 1
+            parameters = dict(parameters, initial_path=[cities[index] for index in order.tolist()])
+        else:
+            self.misses += 1
+        path, length, _ = SOLVERS[solver](cities, **parameters)
+        self.put(coordinates, parameter_key, tsp_general_functions.path_indices(path, cities), length)
+        return path, length, time.time() - t0
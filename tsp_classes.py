@@ -1,9 +1,17 @@
 from __future__ import annotations
-from typing import Tuple, Set, List, Dict
+from typing import Tuple, Set, List, Dict, Optional, Sequence, Union, TYPE_CHECKING
 import numpy as np
 
+if TYPE_CHECKING:
+    from tsp_spatial import SpatialGrid
+
+# Largest full distance matrix (in bytes) that we keep in memory, larger instances compute distances on demand
+MAX_MATRIX_BYTES = 2 ** 30
+
 
 class Location:
+    __slots__ = ('x', 'y')
+
     def __init__(self, x: float, y: float):
         self.x = x
         self.y = y
@@ -31,10 +39,86 @@ class Location:
         return self.x != other.x or self.y != other.y
 
 
+class DistanceMatrix:
+    def __init__(self, cities: Sequence[City], max_bytes: int = MAX_MATRIX_BYTES):
+        """
+        Precompute the euclidean distances between all cities. Each city gets a dense integer index (its position in
+        cities) and a reference to this matrix, after which City.distance_to reads from the matrix.
+        If the n x n matrix does not fit in max_bytes the distances are computed on demand instead.
+        :param cities: All cities of the instance, a list of cities or a CityArray
+        :param max_bytes: The maximum size of the full matrix in bytes
+        """
+        self.coordinates = np.asarray(CityArray.from_cities(cities).coordinates, dtype=np.float64)
+        self.x = self.coordinates[:, 0]
+        self.y = self.coordinates[:, 1]
+        num_cities = len(cities)
+        if num_cities * num_cities * 8 <= max_bytes:
+            # Fill the matrix in place, the only temporary is a block of rows of the y differences
+            self.matrix = np.subtract.outer(self.x, self.x)
+            np.square(self.matrix, out=self.matrix)
+            block_size = max(1, 2 ** 20 // max(num_cities, 1))
+            for start in range(0, num_cities, block_size):
+                block = np.subtract.outer(self.y[start: start + block_size], self.y)
+                np.square(block, out=block)
+                self.matrix[start: start + block_size] += block
+            np.sqrt(self.matrix, out=self.matrix)
+        else:
+            self.matrix = None
+
+        if isinstance(cities, CityArray):
+            # The city views handed out by the array pick up the matrix
+            cities.distance_matrix = self
+        else:
+            for index, city in enumerate(cities):
+                city.index = index
+                city.distance_matrix = self
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def distance(self, index1: int, index2: int) -> float:
+        """
+        Distance between two cities
+        :param index1: Index of the first city
+        :param index2: Index of the second city
+        :return: euclidean distance between the two cities
+        """
+        if self.matrix is not None:
+            return self.matrix[index1, index2]
+        return np.sqrt((self.x[index1] - self.x[index2]) ** 2 + (self.y[index1] - self.y[index2]) ** 2)
+
+    def distances(self, index: int, others: np.ndarray) -> np.ndarray:
+        """
+        Distances from one city to an array of other cities
+        :param index: Index of the city
+        :param others: Indices of the other cities
+        :return: Array with the distance to each of the other cities
+        """
+        if self.matrix is not None:
+            return self.matrix[index, others]
+        return np.sqrt((self.x[others] - self.x[index]) ** 2 + (self.y[others] - self.y[index]) ** 2)
+
+    def path_distances(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Lengths of the arcs of a closed path
+        :param indices: Indices of the cities in the order in which they are visited
+        :return: Array with the distance from each city to the next one (the last one connects to the first)
+        """
+        next_indices = np.roll(indices, -1)
+        if self.matrix is not None:
+            return self.matrix[indices, next_indices]
+        return np.sqrt((self.x[next_indices] - self.x[indices]) ** 2 + (self.y[next_indices] - self.y[indices]) ** 2)
+
+
 class City:
+    __slots__ = ('id', 'location', 'index', 'distance_matrix')
+
     def __init__(self, id: int, x: float, y: float):
         self.id = id
         self.location = Location(x, y)
+        # Set by CityArray and DistanceMatrix, the position of the city in its instance
+        self.index = None
+        self.distance_matrix = None
 
     def distance_to(self, other: City) -> float:
         """
@@ -42,14 +126,42 @@ class City:
         :param other: Another city
         :return: euclidean distance between the two cities
         """
+        if self.distance_matrix is not None and self.distance_matrix is other.distance_matrix:
+            return self.distance_matrix.distance(self.index, other.index)
         return self.location.distance(other.location)
 
-    def closest_other_city(self, other_cities: Set[City]) -> Tuple[City, float]:
+    def shares_distance_matrix(self, other_cities) -> Optional[DistanceMatrix]:
+        """
+        Check if self and all other cities read their distances from the same distance matrix
+        :param other_cities: Collection of other cities
+        :return: The shared distance matrix or None
+        """
+        distance_matrix = self.distance_matrix
+        if distance_matrix is None or any(city.distance_matrix is not distance_matrix for city in other_cities):
+            return None
+        return distance_matrix
+
+    def closest_other_city(self, other_cities: Set[City],
+                           spatial_index: Optional[SpatialGrid] = None) -> Tuple[City, float]:
         """
         Find the closest city among a list of other cities
         :param other_cities: List of cities from which we select the closest city
+        :param spatial_index: Grid that holds exactly the other cities, speeds up the search for large instances
         :return: The closest city and minimal distance
         """
+        if spatial_index is not None:
+            indices, distances = spatial_index.nearest(self.location.x, self.location.y)
+            if len(indices) == 0:
+                return None, np.inf
+            return spatial_index.cities[int(indices[0])], distances[0]
+
+        distance_matrix = self.shares_distance_matrix(other_cities)
+        if distance_matrix is not None and len(other_cities) > 0:
+            other_cities = list(other_cities)
+            distances = distance_matrix.distances(self.index, np.array([city.index for city in other_cities]))
+            best = int(np.argmin(distances))
+            return other_cities[best], distances[best]
+
         best_extra_distance = np.inf
         best_city = None
         for city in other_cities:
@@ -59,13 +171,37 @@ class City:
                 best_city = city
         return best_city, best_extra_distance
 
-    def closest_other_city_dict(self, other_cities: Set[City]) -> Tuple[Dict[City, float], float]:
+    def closest_other_city_dict(self, other_cities: Set[City], spatial_index: Optional[SpatialGrid] = None,
+                                fraction_of_best: float = np.inf) -> Tuple[Dict[City, float], float]:
         """
         Calculate the distance to each other city and store results in a dictionary.
         Also return the distance to the closest other city
         :param other_cities: Set of cities to which e calculate the distance
+        :param spatial_index: Grid that holds exactly the other cities, requires a finite fraction_of_best
+        :param fraction_of_best: Only keep the cities no further than fraction_of_best * the closest distance
         :return: The closest city and minimal distance
         """
+        if spatial_index is not None:
+            x, y = self.location.x, self.location.y
+            _, closest_distance = spatial_index.nearest(x, y)
+            if len(closest_distance) == 0:
+                return {}, np.inf
+            best_extra_distance = closest_distance[0]
+            indices, distances = spatial_index.within(x, y, fraction_of_best * best_extra_distance)
+            cities = spatial_index.cities
+            return {cities[index]: distance for index, distance in zip(indices.tolist(), distances)}, \
+                best_extra_distance
+
+        distance_matrix = self.shares_distance_matrix(other_cities)
+        if distance_matrix is not None and len(other_cities) > 0:
+            other_cities = list(other_cities)
+            distances = distance_matrix.distances(self.index, np.array([city.index for city in other_cities]))
+            best_extra_distance = distances.min()
+            if fraction_of_best < np.inf:
+                return {city: distance for city, distance in zip(other_cities, distances)
+                        if distance <= fraction_of_best * best_extra_distance}, best_extra_distance
+            return dict(zip(other_cities, distances)), best_extra_distance
+
         best_extra_distance = np.inf
         extra_distances = {}
         # For each city calculate the distance
@@ -74,6 +210,9 @@ class City:
             if extra_distances[city] < best_extra_distance:
                 # Remember the distance to the closest city
                 best_extra_distance = extra_distances[city]
+        if fraction_of_best < np.inf:
+            extra_distances = {city: extra_distance for city, extra_distance in extra_distances.items()
+                               if extra_distance <= fraction_of_best * best_extra_distance}
         return extra_distances, best_extra_distance
 
     def best_insertion_position(self, path: List[City]) -> Tuple[int, float]:
@@ -83,6 +222,14 @@ class City:
         :return: the index of the best insertion position (place self on this index)
         and the additional distance of the insertion
         """
+        distance_matrix = self.shares_distance_matrix(path)
+        if distance_matrix is not None and len(path) > 0:
+            indices = np.array([city.index for city in path])
+            extra_distances = distance_matrix.distances(self.index, indices) \
+                + distance_matrix.distances(self.index, np.roll(indices, -1))
+            best = int(np.argmin(extra_distances))
+            return (best + 1) % len(path), extra_distances[best]
+
         best_index = None
         best_extra_distance = np.inf
         for index1, city1 in enumerate(path):
@@ -126,4 +273,189 @@ class City:
         return self.id >= other.id
 
     def __gt__(self, other):
-        return self.id > other.id
\ No newline at end of file
+        return self.id > other.id
+
+
+class CityArray:
+    def __init__(self, coordinates: np.ndarray, ids: Optional[np.ndarray] = None):
+        """
+        Compact store of an instance: the coordinates of all cities in one contiguous (n, 2) array instead of a City
+        and Location object per city. Indexing returns lightweight City views that know their index in the array.
+        :param coordinates: Array with the x and y coordinate of each city
+        :param ids: The id of each city, if None the id of a city equals its index
+        """
+        self.coordinates = np.asarray(coordinates)
+        if not np.issubdtype(self.coordinates.dtype, np.floating):
+            self.coordinates = self.coordinates.astype(np.float64)
+        if self.coordinates.ndim != 2 or self.coordinates.shape[1] != 2:
+            raise ValueError(f"Coordinates should have shape (n, 2), got {self.coordinates.shape}")
+        self._ids = None if ids is None else np.ascontiguousarray(ids, dtype=np.int64)
+        self.distance_matrix = None
+
+    @classmethod
+    def from_cities(cls, cities: Sequence[City]) -> CityArray:
+        """
+        Store a list of cities in a CityArray, a CityArray is returned as is
+        :param cities: The cities to store
+        :return: The array backed instance
+        """
+        if isinstance(cities, CityArray):
+            return cities
+        coordinates = np.array([(city.location.x, city.location.y) for city in cities], dtype=np.float64)
+        return cls(coordinates.reshape(-1, 2), np.array([city.id for city in cities], dtype=np.int64))
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.coordinates[:, 0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.coordinates[:, 1]
+
+    @property
+    def ids(self) -> np.ndarray:
+        if self._ids is None:
+            return np.arange(len(self))
+        return self._ids
+
+    def city(self, index: int) -> City:
+        """
+        Create a City view on one entry of the array
+        :param index: Index of the city in the array
+        :return: City with the id and location of the entry
+        """
+        city = City(index if self._ids is None else int(self._ids[index]),
+                    float(self.coordinates[index, 0]), float(self.coordinates[index, 1]))
+        city.index = index
+        city.distance_matrix = self.distance_matrix
+        return city
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[City, List[City]]:
+        if isinstance(item, slice):
+            return [self.city(index) for index in range(*item.indices(len(self)))]
+        item = int(item)
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("CityArray index out of range")
+        return self.city(item)
+
+    def __iter__(self):
+        return (self.city(index) for index in range(len(self)))
+
+    def __contains__(self, city):
+        if not isinstance(city, City):
+            return False
+        index = city.index
+        if index is not None and 0 <= index < len(self) and self.city(index) == city:
+            return True
+        # The city is not a view on this array, look for its id
+        return any(self.city(int(index)) == city for index in np.flatnonzero(self.ids == city.id))
+
+    def __str__(self):
+        return "CityArray with {} cities".format(len(self))
+
+    def __repr__(self):
+        return "CityArray with {} cities".format(len(self))
+
+
+class Tour:
+    def __init__(self, order: Sequence[int]):
+        """
+        A path stored as an array with the city index at each position and the inverse array with the position of each
+        city. Segment reversals and relocations are applied in place.
+        :param order: Indices of the cities in the order in which they are visited
+        """
+        self.order = np.array(order, dtype=np.intp)
+        self.position = np.empty(self.order.max() + 1 if len(self.order) > 0 else 0, dtype=np.intp)
+        self.position[self.order] = np.arange(len(self.order))
+
+    def __len__(self):
+        return len(self.order)
+
+    def next(self, city: int) -> int:
+        return int(self.order[(self.position[city] + 1) % len(self.order)])
+
+    def previous(self, city: int) -> int:
+        return int(self.order[self.position[city] - 1])
+
+    def _write(self, positions: np.ndarray, cities: np.ndarray) -> np.ndarray:
+        self.order[positions] = cities
+        self.position[cities] = positions
+        return positions
+
+    def reverse(self, start: int, end: int) -> np.ndarray:
+        """
+        Reverse the cities between two positions, the segment may wrap around the end of the array. On a closed path
+        reversing the other part gives the same path, so the shorter of the two is reversed.
+        :param start: Position of the first city of the segment
+        :param end: Position of the last city of the segment
+        :return: The positions that changed
+        """
+        num_cities = len(self.order)
+        segment_length = (end - start) % num_cities + 1
+        if num_cities - segment_length < segment_length:
+            start, segment_length = end + 1, num_cities - segment_length
+        positions = (start + np.arange(segment_length)) % num_cities
+        return self._write(positions, self.order[positions[::-1]])
+
+    def _shift(self, start: int, segment_length: int, insert_position: int, reverse: bool,
+               forward: bool) -> np.ndarray:
+        """
+        Move the segment of segment_length cities at start behind the city at insert_position, by shifting the cities
+        between the segment and insert_position forward or backward
+        """
+        num_cities = len(self.order)
+        segment = self.order[(start + np.arange(segment_length)) % num_cities]
+        if reverse:
+            segment = segment[::-1]
+        if forward:
+            # ...[segment][between] -> ...[between][segment]
+            num_between = (insert_position - start - segment_length + 1) % num_cities
+            positions = (start + np.arange(segment_length + num_between)) % num_cities
+            cities = np.concatenate((self.order[positions[segment_length:]], segment))
+        else:
+            # [between][segment]... -> [segment][between]...
+            num_between = (start - insert_position - 1) % num_cities
+            positions = (insert_position + 1 + np.arange(num_between + segment_length)) % num_cities
+            cities = np.concatenate((segment, self.order[positions[:num_between]]))
+        return self._write(positions, cities)
+
+    def move_segment(self, start: int, segment_length: int, insert_position: int, reverse: bool) -> np.ndarray:
+        """
+        Move a segment behind the city at insert_position, which lies outside of the segment. Only the cities between
+        the segment and the insert position on the shorter side move.
+        :param start: Position of the first city of the segment
+        :param segment_length: The number of cities in the segment
+        :param insert_position: The segment is placed after the city at this position
+        :param reverse: bool If we want to reverse the segment
+        :return: The positions that changed
+        """
+        num_cities = len(self.order)
+        num_forward = (insert_position - start - segment_length + 1) % num_cities
+        num_backward = (start - insert_position - 1) % num_cities
+        return self._shift(start, segment_length, insert_position, reverse, num_forward <= num_backward)
+
+    def re_insert_segment(self, segment: Tuple[int, int], insert_left_index: int, reverse: bool) -> np.ndarray:
+        """
+        In place version of tsp_general_functions.re_insert_path_segment, with the same meaning of the arguments
+        :param segment: Tuple of the indices of the segment to remove, segment[0] <= segment[1]
+        :param insert_left_index: Insert the removed segment after this index in the path after removal
+        :param reverse: bool If we want to reverse the segment
+        :return: The positions that changed
+        """
+        segment_length = segment[1] - segment[0] + 1
+        if insert_left_index < segment[0]:
+            return self._shift(segment[0], segment_length, insert_left_index, reverse, forward=False)
+        return self._shift(segment[0], segment_length, insert_left_index + segment_length, reverse, forward=True)
+
+    def path(self, cities: Sequence[City]) -> List[City]:
+        """
+        The path as a list of cities
+        :param cities: All cities, the tour holds indices into it
+        :return: The path
+        """
+        return [cities[index] for index in self.order.tolist()]
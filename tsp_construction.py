@@ -0,0 +1,321 @@
+from typing import List, Optional, Tuple
+import numpy as np
+
+import tsp_profiling
+from tsp_classes import City, CityArray
+from tsp_spatial import SpatialGrid
+
+
+def set_order(cities: List[City], start: int = 0) -> np.ndarray:
+    """
+    The order in which a set of all cities except start iterates over them. Removing cities from a set does not
+    change the order of the others, so this is also the order in which City.closest_other_city meets the unvisited
+    cities, and the order in which it breaks ties between cities at the same distance.
+    :param cities: all cities to be visited
+    :param start: Index of the first city on the path
+    :return: The indices of the other cities in iteration order
+    """
+    positions = {city: index for index, city in enumerate(cities)}
+    others = set(cities[index] for index in range(len(cities)) if index != start)
+    return np.array([positions[city] for city in others], dtype=np.intp)
+
+
+def nearest_neighbour_order(coordinates: np.ndarray, start: int = 0, spatial_index: bool = False,
+                            priority: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Nearest neighbour heuristic on a coordinate array. Each step computes the distance from the current city to all
+    remaining cities in one array operation, visited cities are masked out.
+    Ties are broken in favour of the city that comes first in priority, with the priority of set_order() this gives
+    the same tour as City.closest_other_city on a set of the cities.
+    :param coordinates: Array with the x and y coordinate of each city
+    :param start: Index of the first city on the path
+    :param spatial_index: Find the closest unvisited city with a SpatialGrid instead of scanning all remaining cities,
+    ties are then broken in favour of the lowest index
+    :param priority: The indices of the cities in the order in which ties are broken, by default the lowest index wins
+    :return: Array with the indices of the cities in the order in which they are visited
+    """
+    num_cities = len(coordinates)
+    order = np.empty(num_cities, dtype=np.intp)
+    if num_cities == 0:
+        return order
+    order[0] = start
+
+    if spatial_index:
+        grid = SpatialGrid(CityArray(coordinates))
+        grid.remove(start)
+        for step in range(1, num_cities):
+            closest, _ = grid.nearest(coordinates[order[step - 1], 0], coordinates[order[step - 1], 1])
+            order[step] = closest[0]
+            grid.remove(int(closest[0]))
+        stats = tsp_profiling.current()
+        if stats is not None:
+            stats.count('distance_evaluations', grid.distance_evaluations)
+        return order
+
+    # Indices of the cities that still have to be visited, sorted such that argmin returns the first city in priority
+    # on a tie
+    if priority is None:
+        remaining = np.delete(np.arange(num_cities), start)
+    else:
+        priority = np.asarray(priority, dtype=np.intp)
+        remaining = priority[priority != start]
+    x = coordinates[remaining, 0].astype(np.float64)
+    y = coordinates[remaining, 1].astype(np.float64)
+    visited = np.zeros(len(remaining), dtype=bool)
+    num_visited = 0
+    current = start
+    distance_evaluations = 0
+    for step in range(1, num_cities):
+        distances = np.sqrt((x - coordinates[current, 0]) ** 2 + (y - coordinates[current, 1]) ** 2)
+        distance_evaluations += len(distances)
+        distances[visited] = np.inf
+        closest = int(np.argmin(distances))
+        current = remaining[closest]
+        order[step] = current
+        visited[closest] = True
+        num_visited += 1
+
+        if num_visited > len(remaining) // 2:
+            # Drop the visited cities such that each step only works on the remaining ones
+            keep = ~visited
+            remaining, x, y = remaining[keep], x[keep], y[keep]
+            visited = np.zeros(len(remaining), dtype=bool)
+            num_visited = 0
+    stats = tsp_profiling.current()
+    if stats is not None:
+        stats.count('distance_evaluations', distance_evaluations)
+    return order
+
+
+def nearest_neighbour_path(cities: List[City], start: int = 0, spatial_index: bool = False) -> List[City]:
+    """
+    Construct a path with the vectorized nearest neighbour heuristic. Without spatial index ties are broken as by
+    City.closest_other_city on a set of the cities
+    :param cities: all cities to be visited, a list of cities or a CityArray
+    :param start: Index of the first city on the path
+    :param spatial_index: Find the closest unvisited city with a SpatialGrid
+    :return: The path
+    """
+    priority = None if spatial_index else set_order(cities, start)
+    order = nearest_neighbour_order(CityArray.from_cities(cities).coordinates, start, spatial_index, priority)
+    return [cities[index] for index in order.tolist()]
+
+
+def cheapest_insertion_order(coordinates: np.ndarray, start: int = 0, block_size: int = 2 ** 20) -> np.ndarray:
+    """
+    Cheapest insertion heuristic: repeatedly insert the unvisited city that increases the path length the least.
+    The cheapest insertion cost and arc of every unvisited city are cached. After an insertion only the two new arcs
+    are compared with the cache, a full (vectorized) rescan of the path is only needed for the cities whose cached
+    arc was the one that got split.
+    :param coordinates: Array with the x and y coordinate of each city
+    :param start: Index of the first city on the path
+    :param block_size: The maximum number of city-arc pairs evaluated in one array operation during a rescan
+    :return: Array with the indices of the cities in the order in which they are visited
+    """
+    num_cities = len(coordinates)
+    x = coordinates[:, 0].astype(np.float64)
+    y = coordinates[:, 1].astype(np.float64)
+    distance_evaluations = 0
+
+    def distances(cities1, cities2):
+        nonlocal distance_evaluations
+        result = np.sqrt((x[cities1] - x[cities2]) ** 2 + (y[cities1] - y[cities2]) ** 2)
+        distance_evaluations += np.size(result)
+        return result
+
+    # The path is a linked list, an arc is identified by the city it starts from
+    next_city = np.full(num_cities, -1, dtype=np.intp)
+    next_city[start] = start
+    arc_length = np.zeros(num_cities)
+    # The cities on the path in the order in which they were inserted, and the slot of each city in that array
+    path_cities = np.empty(num_cities, dtype=np.intp)
+    path_cities[0] = start
+    slot = np.empty(num_cities, dtype=np.intp)
+    slot[start] = 0
+    path_size = 1
+
+    # Cheapest insertion cost and arc of each unvisited city, visited cities get an infinite cost
+    best_cost = 2 * distances(np.arange(num_cities), start)
+    best_arc = np.full(num_cities, start, dtype=np.intp)
+    best_cost[start] = np.inf
+    unvisited = np.delete(np.arange(num_cities), start)
+
+    for _ in range(num_cities - 1):
+        # On a tie the city with the lowest index is inserted
+        city = int(np.argmin(best_cost))
+        arc_start = best_arc[city]
+        arc_end = next_city[arc_start]
+        next_city[arc_start] = city
+        next_city[city] = arc_end
+        arc_length[arc_start] = distances(arc_start, city)
+        arc_length[city] = distances(city, arc_end)
+        path_cities[path_size] = city
+        slot[city] = path_size
+        path_size += 1
+        best_cost[city] = np.inf
+        unvisited = unvisited[unvisited != city]
+        if len(unvisited) == 0:
+            break
+
+        # The arc arc_start-arc_end is replaced by arc_start-city and city-arc_end
+        to_city = distances(unvisited, city)
+        cost_before = distances(unvisited, arc_start) + to_city - arc_length[arc_start]
+        cost_after = to_city + distances(unvisited, arc_end) - arc_length[city]
+        split = best_arc[unvisited] == arc_start
+        new_cost = np.minimum(cost_before, cost_after)
+        new_arc = np.where(cost_before <= cost_after, arc_start, city)
+        # The old cost is a lower bound for the other arcs of a city whose cheapest arc got split, so one of the new
+        # arcs is only known to be the cheapest if it is not more expensive than the split arc
+        better = new_cost < best_cost[unvisited]
+        best_cost[unvisited[better]] = new_cost[better]
+        best_arc[unvisited[better]] = new_arc[better]
+        rescan = unvisited[split & ~better]
+
+        if len(rescan) > 0:
+            arc_starts = path_cities[:path_size]
+            arc_end_slots = slot[next_city[arc_starts]]
+            rows_per_block = max(1, block_size // path_size)
+            for block in range(0, len(rescan), rows_per_block):
+                cities = rescan[block: block + rows_per_block]
+                to_path = distances(cities[:, np.newaxis], arc_starts)
+                cost = to_path + to_path[:, arc_end_slots] - arc_length[arc_starts]
+                cheapest = np.argmin(cost, axis=1)
+                best_cost[cities] = cost[np.arange(len(cities)), cheapest]
+                best_arc[cities] = arc_starts[cheapest]
+
+    stats = tsp_profiling.current()
+    if stats is not None:
+        stats.count('distance_evaluations', distance_evaluations)
+    order = np.empty(num_cities, dtype=np.intp)
+    city = start
+    for index in range(num_cities):
+        order[index] = city
+        city = next_city[city]
+    return order
+
+
+def cheapest_insertion_path(cities: List[City], start: int = 0) -> List[City]:
+    """
+    Construct a path with the cheapest insertion heuristic
+    :param cities: all cities to be visited, a list of cities or a CityArray
+    :param start: Index of the first city on the path
+    :return: The path
+    """
+    order = cheapest_insertion_order(CityArray.from_cities(cities).coordinates, start)
+    return [cities[index] for index in order.tolist()]
+
+
+def hilbert_order(coordinates: np.ndarray, bounds: Optional[Tuple[float, float, float, float]] = None,
+                  curve_order: Optional[int] = None) -> np.ndarray:
+    """
+    Space filling curve heuristic: visit the cities in the order of their position along a Hilbert curve over the
+    canvas. Cities that are close on the curve are close on the canvas, so the tour is reasonable (typically 25% to
+    40% above the optimum for uniform cities) while it only takes a sort.
+    :param coordinates: Array with the x and y coordinate of each city
+    :param bounds: (min_x, min_y, max_x, max_y) of the canvas, e.g. (0, 0, MAX_X, MAX_Y) from start_up. If None the
+    bounding box of the cities is used
+    :param curve_order: The curve divides the canvas into 2 ** curve_order by 2 ** curve_order cells, by default
+    about 16 cells per city
+    :return: Array with the indices of the cities in the order in which they are visited
+    """
+    num_cities = len(coordinates)
+    if num_cities == 0:
+        return np.empty(0, dtype=np.intp)
+    if bounds is None:
+        bounds = (*coordinates.min(axis=0), *coordinates.max(axis=0))
+    if curve_order is None:
+        curve_order = min(max(int(np.ceil(np.log2(num_cities) / 2)) + 2, 1), 15)
+    min_x, min_y, max_x, max_y = bounds
+    side = 2 ** curve_order
+    # Scale both axes by the same factor, such that the curve follows the shape of the canvas
+    scale = (side - 1) / max(max_x - min_x, max_y - min_y, 1e-9)
+    x = np.clip((coordinates[:, 0] - min_x) * scale, 0, side - 1).astype(np.int32)
+    y = np.clip((coordinates[:, 1] - min_y) * scale, 0, side - 1).astype(np.int32)
+
+    # Distance along the curve, one bit of x and y per level for all cities at once
+    distance = np.zeros(num_cities, dtype=np.int32)
+    level = side // 2
+    while level > 0:
+        rx = (x & level) > 0
+        ry = (y & level) > 0
+        distance += level * level * ((3 * rx) ^ ry)
+        # Rotate the quadrant such that the curve in it has the standard orientation, side - 1 - x flips all bits
+        flip = (side - 1) * (rx & ~ry)
+        x ^= flip
+        y ^= flip
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        level //= 2
+    return np.argsort(distance, kind='stable')
+
+
+def hilbert_path(cities: List[City], bounds: Optional[Tuple[float, float, float, float]] = None) -> List[City]:
+    """
+    Construct a path with the Hilbert curve heuristic
+    :param cities: all cities to be visited, a list of cities or a CityArray
+    :param bounds: (min_x, min_y, max_x, max_y) of the canvas, if None the bounding box of the cities is used
+    :return: The path
+    """
+    order = hilbert_order(CityArray.from_cities(cities).coordinates, bounds)
+    return [cities[index] for index in order.tolist()]
+
+
+def insert_cities(coordinates: np.ndarray, order: np.ndarray, cities: np.ndarray, k: int = 8,
+                  grid: Optional[SpatialGrid] = None) -> np.ndarray:
+    """
+    Insert cities into an existing path, one after the other, each at the position where it adds the least length
+    among the arcs next to its k nearest cities on the path. The path is kept as a linked list, so the insertions cost
+    time in proportion to the number of inserted cities. Building the grid (unless one is given) and the returned
+    order take O(n) array operations.
+    :param coordinates: Array with the x and y coordinate of each city
+    :param order: Indices of the cities on the path in the order in which they are visited
+    :param cities: Indices of the cities to insert
+    :param k: The number of nearest cities on the path whose arcs are candidate insertion positions
+    :param grid: A SpatialGrid over coordinates that holds exactly the cities on the path, e.g. kept by the caller
+    between repairs. The inserted cities are added to it
+    :return: The order of the cities on the extended path
+    """
+    order = np.asarray(order, dtype=np.intp)
+    cities = np.asarray(cities, dtype=np.intp)
+    if len(cities) == 0:
+        return order
+    if len(order) == 0:
+        order, cities = cities[:1], cities[1:]
+        if grid is not None:
+            grid.add(int(order[0]))
+    x = coordinates[:, 0].astype(np.float64)
+    y = coordinates[:, 1].astype(np.float64)
+    next_city = np.full(len(coordinates), -1, dtype=np.intp)
+    previous_city = np.full(len(coordinates), -1, dtype=np.intp)
+    next_city[order] = np.roll(order, -1)
+    previous_city[order] = np.roll(order, 1)
+
+    if grid is None:
+        # The grid holds the cities on the path
+        grid = SpatialGrid(CityArray(coordinates))
+        for city in cities.tolist():
+            grid.remove(city)
+    for city in cities.tolist():
+        nearest, _ = grid.nearest(x[city], y[city], k)
+        # The arcs that start and the arcs that end at the nearest cities
+        starts = np.concatenate((nearest, previous_city[nearest]))
+        ends = np.concatenate((next_city[nearest], nearest))
+        costs = np.sqrt((x[starts] - x[city]) ** 2 + (y[starts] - y[city]) ** 2) \
+            + np.sqrt((x[ends] - x[city]) ** 2 + (y[ends] - y[city]) ** 2) \
+            - np.sqrt((x[ends] - x[starts]) ** 2 + (y[ends] - y[starts]) ** 2)
+        best = int(np.argmin(costs))
+        start, end = starts[best], ends[best]
+        next_city[start], previous_city[city] = city, start
+        next_city[city], previous_city[end] = end, city
+        grid.add(city)
+
+    # Collect the inserted cities that follow each city of the original path and insert them all at once
+    inserted = np.zeros(len(coordinates), dtype=bool)
+    inserted[cities] = True
+    positions, chains = [], []
+    for position in np.flatnonzero(inserted[next_city[order]]).tolist():
+        city = next_city[order[position]]
+        while inserted[city]:
+            positions.append(position + 1)
+            chains.append(city)
+            city = next_city[city]
+    return np.insert(order, positions, chains)
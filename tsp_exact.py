@@ -0,0 +1,72 @@
+from typing import List, Tuple
+import time
+import numpy as np
+
+import tsp_general_functions
+from tsp_classes import City, CityArray
+
+# The tables of held_karp_order hold 2^(n-1) * (n-1) entries, 20 cities need about 100 MB
+MAX_CITIES = 20
+
+
+def held_karp_order(coordinates: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Optimal tour with the Held-Karp dynamic program. The tour starts at city 0, best[subset, j] is the length of the
+    shortest path from city 0 through the cities in subset that ends at city j. The subsets are processed by their
+    number of cities, all subsets of one size are extended at once with array operations.
+    :param coordinates: Array with the x and y coordinate of each city, at most MAX_CITIES cities
+    :return: The order of the cities, starting with 0, and the tour length
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    num_cities = len(coordinates)
+    if num_cities > MAX_CITIES:
+        raise ValueError(f"Held-Karp needs 2^{num_cities - 1} subsets, use at most {MAX_CITIES} cities")
+    if num_cities <= 3:
+        order = np.arange(num_cities)
+        return order, tsp_general_functions.tour_length(coordinates, order)
+
+    distances = np.sqrt(((coordinates[:, np.newaxis] - coordinates[np.newaxis]) ** 2).sum(axis=2))
+    # Bit j of a subset stands for city j + 1, city 0 is never part of a subset
+    num_others = num_cities - 1
+    others = distances[1:, 1:]
+    subsets = np.arange(2 ** num_others, dtype=np.int64)
+    sizes = np.zeros(len(subsets), dtype=np.int8)
+    for bit in range(num_others):
+        sizes += (subsets >> bit) & 1
+    subsets_by_size = np.argsort(sizes, kind='stable')
+    size_starts = np.searchsorted(sizes[subsets_by_size], np.arange(num_others + 2))
+
+    best = np.full((len(subsets), num_others), np.inf)
+    previous = np.zeros((len(subsets), num_others), dtype=np.int8)
+    best[1 << np.arange(num_others), np.arange(num_others)] = distances[0, 1:]
+    for size in range(2, num_others + 1):
+        layer = subsets_by_size[size_starts[size]: size_starts[size + 1]]
+        for last in range(num_others):
+            layer_subsets = layer[(layer >> last) & 1 == 1]
+            # Paths through the subset without the last city, the entries of cities outside of it are infinite
+            lengths = best[layer_subsets ^ (1 << last)] + others[:, last]
+            previous_city = lengths.argmin(axis=1)
+            best[layer_subsets, last] = lengths[np.arange(len(layer_subsets)), previous_city]
+            previous[layer_subsets, last] = previous_city
+
+    # Close the tour and follow the previous cities back to city 0
+    subset = len(subsets) - 1
+    lengths = best[subset] + distances[1:, 0]
+    last = int(lengths.argmin())
+    order = [last + 1]
+    while subset != 1 << last:
+        subset, last = subset ^ (1 << last), int(previous[subset, last])
+        order.append(last + 1)
+    order.append(0)
+    return np.array(order[::-1]), float(lengths.min())
+
+
+def held_karp(cities: List[City]) -> Tuple[List[City], float, float]:
+    """
+    Solve a small instance to optimality with held_karp_order
+    :param cities: all cities to be visited, at most MAX_CITIES
+    :return: The path, the objective, the computation time
+    """
+    t0 = time.time()
+    order, length = held_karp_order(CityArray.from_cities(cities).coordinates)
+    return [cities[index] for index in order.tolist()], length, time.time() - t0
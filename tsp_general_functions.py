@@ -1,31 +1,107 @@
-from typing import List, Tuple
+from typing import List, NamedTuple, Optional, Tuple, Union
 import random
-import matplotlib.pyplot as plt
 import numpy as np
 import warnings
 
 
-from tsp_classes import City
-import networkx as nx
+from tsp_classes import City, CityArray, DistanceMatrix, Tour
 
+# Size of the canvas on which start_up places the cities
+MAX_X = 100
+MAX_Y = 100
 
-def start_up(num_cities: int) -> Tuple[List[City], nx.Graph]:
+
+class Instance:
+    def __init__(self, cities: Union[List[City], CityArray]):
+        """
+        Lightweight handle on the cities of an instance as returned by start_up. The networkx graph with a node per
+        city is only built (and networkx only imported) when it is needed for drawing. Attributes of the graph can be
+        used directly on the instance, e.g. instance.nodes, which builds the graph as well.
+        :param cities: all cities of the instance
+        """
+        self.cities = cities
+        self._graph = None
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            import networkx as nx
+
+            self._graph = nx.DiGraph()
+            for city in self.cities:
+                self._graph.add_node(city, pos=(city.location.x, city.location.y))
+        return self._graph
+
+    def __getattr__(self, name: str):
+        # Only called for attributes that the instance does not have itself
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.graph, name)
+
+    def __len__(self):
+        return len(self.cities)
+
+    def __str__(self):
+        return "Instance with {} cities".format(len(self.cities))
+
+    def __repr__(self):
+        return "Instance with {} cities".format(len(self.cities))
+
+
+def start_up(num_cities: int, distance_matrix: bool = False, as_array: bool = False,
+             seed: int = 1) -> Tuple[Union[List[City], CityArray], Instance]:
     """
-    Start up the assignment by creating cities on a canvas and storing them in a graph
+    Start up the assignment by creating cities on a canvas
     :param num_cities: THe number of cities
-    :return: list of cities and a graph
+    :param distance_matrix: Precompute the distances between all cities, City.distance_to then reads from the matrix
+    :param as_array: Return the cities as a compact CityArray instead of a list of City objects
+    :param seed: The random seed, the assignment uses 1
+    :return: list of cities and the instance, which builds the graph of the cities on demand
     """
-    MAX_X = 100
-    MAX_Y = 100
-    random.seed(1)
+    # A private generator gives the same cities as seeding the global one, without changing the global state
+    rng = random.Random(seed)
+
+    cities = [City(id, rng.randint(0, MAX_X), rng.randint(0, MAX_Y)) for id in range(num_cities)]
+    if as_array:
+        cities = CityArray.from_cities(cities)
+
+    if distance_matrix:
+        DistanceMatrix(cities)
 
-    cities = [City(id, random.randint(0, MAX_X), random.randint(0, MAX_Y)) for id in range(num_cities)]
+    return cities, Instance(cities)
 
-    G = nx.DiGraph()
-    for city in cities:
-        G.add_node(city, pos=(city.location.x, city.location.y))
 
-    return cities, G
+def generate_instance(num_cities: int, seed: Union[None, int, np.random.Generator] = None,
+                      distribution: str = 'uniform', num_clusters: Optional[int] = None, cluster_std: float = 0.05,
+                      integer: bool = False) -> CityArray:
+    """
+    Create random cities on the canvas of start_up in a single vectorized call
+    :param num_cities: The number of cities
+    :param seed: Seed or numpy Generator for the coordinates, runs with their own seed or Generator do not affect each
+    other or the global random state
+    :param distribution: 'uniform' spreads the cities evenly over the canvas, 'clustered' draws them from normal
+    distributions around randomly placed cluster centres
+    :param num_clusters: The number of clusters, by default about one per 100 cities
+    :param cluster_std: Standard deviation of the clusters as a fraction of the canvas size
+    :param integer: Round the coordinates to integers like start_up
+    :return: The cities
+    """
+    rng = np.random.default_rng(seed)
+    size = np.array([MAX_X, MAX_Y], dtype=np.float64)
+    if distribution == 'uniform':
+        coordinates = rng.random((num_cities, 2)) * size
+    elif distribution == 'clustered':
+        if num_clusters is None:
+            num_clusters = max(1, num_cities // 100)
+        centres = rng.random((num_clusters, 2)) * size
+        cluster = rng.integers(num_clusters, size=num_cities)
+        coordinates = centres[cluster] + rng.normal(scale=cluster_std, size=(num_cities, 2)) * size
+        np.clip(coordinates, 0, size, out=coordinates)
+    else:
+        raise ValueError(f"Unknown distribution {distribution}, use 'uniform' or 'clustered'")
+    if integer:
+        np.rint(coordinates, out=coordinates)
+    return CityArray(coordinates)
 
 
 def path_length(path: List[City]) -> float:
@@ -34,21 +110,81 @@ def path_length(path: List[City]) -> float:
     :param path: The path for which we calculate the length
     :return: path length
     """
-    length = 0
-    for index_from, city_from in enumerate(path):
-        index_to = (index_from + 1) % len(path)
-        city_to = path[index_to]
-        length += city_from.distance_to(city_to)
-    return length
+    if len(path) > 0:
+        distance_matrix = path[0].shares_distance_matrix(path)
+        if distance_matrix is not None:
+            return distance_matrix.path_distances(np.array([city.index for city in path])).sum()
+
+    return tour_length(np.array([(city.location.x, city.location.y) for city in path], dtype=np.float64))
 
 
-def draw_path(G, path: List[City]):
+def tour_length(coordinates: np.ndarray, order: Optional[np.ndarray] = None) -> float:
+    """
+    Calculate the length of a closed tour over coordinate arrays
+    :param coordinates: Array with the x and y coordinate of each city
+    :param order: Indices of the cities in the order in which they are visited, if None the cities are visited in
+    the order of coordinates
+    :return: tour length
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if order is not None:
+        coordinates = coordinates[np.asarray(order, dtype=np.intp)]
+    if len(coordinates) < 2:
+        return 0.
+    # The arc from each city to the next one, the last city connects to the first
+    differences = np.roll(coordinates, -1, axis=0) - coordinates
+    return float(np.sqrt((differences ** 2).sum(axis=1)).sum())
+
+
+def path_indices(path: List[City], cities: List[City], missing: Optional[int] = None) -> np.ndarray:
+    """
+    Translate a path of cities into the positions of those cities in the list of all cities
+    :param path: The path
+    :param cities: All cities, a list of cities or a CityArray
+    :param missing: The index returned for cities that are not in cities, if None such cities raise a KeyError
+    :return: Array with for each city on the path its index in cities
+    """
+    if isinstance(cities, CityArray) and all(city.index is not None for city in path):
+        # Views on the array know their index, check that they still match the entry in the array
+        indices = np.array([city.index for city in path], dtype=np.intp)
+        inside = (indices >= 0) & (indices < len(cities))
+        path_coordinates = np.array([(city.location.x, city.location.y) for city in path],
+                                    dtype=np.float64).reshape(-1, 2)
+        path_ids = np.array([city.id for city in path], dtype=np.int64)
+        matches = np.zeros(len(path), dtype=bool)
+        matches[inside] = (cities.ids[indices[inside]] == path_ids[inside]) \
+                          & (cities.coordinates[indices[inside]] == path_coordinates[inside]).all(axis=1)
+        if matches.all():
+            return indices
+    positions = {city: index for index, city in enumerate(cities)}
+    if missing is None:
+        return np.array([positions[city] for city in path], dtype=np.intp)
+    return np.array([positions.get(city, missing) for city in path], dtype=np.intp)
+
+
+def draw_path(G, path: List[City], mode: str = 'graph', file_name: Optional[str] = None,
+              max_points: Optional[int] = 20000, max_labels: int = 100, block: bool = True):
     """
     Draw the path on the screen
-    :param G: The graph with all cities
+    :param G: The instance from start_up or a networkx graph with all cities, not used in mode 'lines'
     :param path: The path that we want to draw
+    :param mode: 'graph' draws the path as edges of the networkx graph, 'lines' draws it with render_path as one
+    line collection, which is much faster for large paths
+    :param file_name: In mode 'lines' save the figure to this file instead of showing it
+    :param max_points: In mode 'lines' the maximum number of cities that is drawn
+    :param max_labels: In mode 'lines' the cities are only labelled if the path has at most this many cities
+    :param block: Wait until the window is closed when the figure is shown, with False the call returns right away
     :return: Figure with the path
     """
+    if mode == 'lines':
+        return render_path(path, file_name, max_points, max_labels, show=file_name is None, block=block)
+    if mode != 'graph':
+        raise ValueError(f"Unknown mode {mode}, use 'graph' or 'lines'")
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
+    if isinstance(G, Instance):
+        G = G.graph
     G.remove_edges_from(list(G.edges.keys()))
     for index_from, city_from in enumerate(path):
         index_to = (index_from + 1) % len(path)
@@ -58,24 +194,104 @@ def draw_path(G, path: List[City]):
     nx.draw(G, nx.get_node_attributes(G, 'pos'), node_size=5, with_labels=True)
     length = path_length(path)
     plt.title(f'Your provided solution with length {length}')
-    plt.show()
+    plt.show(block=block)
 
 
-def evaluate_path(path: List[City], cities: List[City], length_path: float):
+def render_path(path: Union[List[City], np.ndarray], file_name: Optional[str] = None,
+                max_points: Optional[int] = 20000, max_labels: int = 100, show: bool = False, block: bool = True):
     """
-    Evaluate if a path is valid, all cities should be valid and the length should match
+    Draw the path as a single LineCollection straight from its coordinates. Without show the figure is created
+    without pyplot, so it can be saved on a machine without a display.
+    :param path: The path, a list of cities or an (n, 2) array with the coordinates in the order of the path
+    :param file_name: Save the figure to this file, the format follows from the extension
+    :param max_points: If the path has more cities only every k-th city is drawn, such that at most max_points are
+    drawn. None draws all cities
+    :param max_labels: The cities are only labelled with their id if the path has at most this many cities
+    :param show: Show the figure on the screen with pyplot
+    :param block: When showing, wait until the window is closed. With False the call returns right away
+    :return: The figure
+    """
+    from matplotlib.collections import LineCollection
+    from matplotlib.figure import Figure
+
+    if isinstance(path, np.ndarray):
+        coordinates = np.asarray(path, dtype=np.float64).reshape(-1, 2)
+        labels = range(len(coordinates))
+    else:
+        coordinates = np.array([(city.location.x, city.location.y) for city in path], dtype=np.float64).reshape(-1, 2)
+        labels = [city.id for city in path]
+    length = tour_length(coordinates)
+    num_cities = len(coordinates)
+
+    # Level of detail: keep every k-th city along the path, the shape of the tour stays recognizable
+    drawn = np.arange(num_cities)
+    if max_points is not None and num_cities > max_points:
+        drawn = drawn[::int(np.ceil(num_cities / max_points))]
+    points = coordinates[drawn]
+    segments = np.stack((points, np.roll(points, -1, axis=0)), axis=1)
+
+    if show:
+        import matplotlib.pyplot as plt
+
+        figure = plt.figure()
+    else:
+        figure = Figure()
+    ax = figure.add_subplot()
+    ax.add_collection(LineCollection(segments, linewidths=0.5 if len(points) > 1000 else 1.))
+    ax.scatter(points[:, 0], points[:, 1], s=5 if len(points) <= 1000 else 0.5, zorder=2)
+    if num_cities <= max_labels:
+        for index in drawn.tolist():
+            ax.annotate(str(labels[index]), coordinates[index], fontsize=8)
+    ax.autoscale_view()
+    ax.set_aspect('equal')
+    title = f'Your provided solution with length {length}'
+    if len(points) < num_cities:
+        title += f' ({len(points)} of {num_cities} cities drawn)'
+    ax.set_title(title)
+
+    if file_name is not None:
+        figure.savefig(file_name)
+    if show:
+        plt.show(block=block)
+    return figure
+
+
+class PathEvaluation(NamedTuple):
+    valid: bool
+    length_correct: bool
+    length: float
+    message: str
+
+
+def evaluate_path(path: List[City], cities: List[City], length_path: float, verbose: bool = True) -> PathEvaluation:
+    """
+    Evaluate if a path is valid, all cities should be valid and the length should match. Validation and the length
+    computation take O(n)
     :param path: The path to evaluate
     :param cities: All cities that need to be visited
     :param length_path: The total path length that you calculated
-    :return: Print in terminal if the path is valid
+    :param verbose: Print the result in terminal
+    :return: Whether the path visits every city once, whether the length matches, the actual path length and a message
     """
-    if all(city in cities for city in path) and len(path) == len(cities) and len(set(path)) == len(set(cities)):
-        if length_path - 0.1 <= path_length(path) <= length_path + 0.1:
-            print('Solution is valid')
-        else:
-            print('Your path is valid, but the objective value is incorrect')
+    indices = path_indices(path, cities, missing=-1)
+    valid = len(path) == len(cities) and bool((indices >= 0).all()) \
+            and bool((np.bincount(indices[indices >= 0], minlength=len(cities)) == 1).all())
+
+    if valid:
+        length = tour_length(CityArray.from_cities(cities).coordinates, indices)
     else:
-        print('Your path is incorrect. Remember that each city should be visited once')
+        length = path_length(path)
+    length_correct = bool(length_path - 0.1 <= length <= length_path + 0.1)
+
+    if not valid:
+        message = 'Your path is incorrect. Remember that each city should be visited once'
+    elif length_correct:
+        message = 'Solution is valid'
+    else:
+        message = 'Your path is valid, but the objective value is incorrect'
+    if verbose:
+        print(message)
+    return PathEvaluation(valid, valid and length_correct, length, message)
 
 
 def re_insert_path_segment(segment: Tuple[int, int], insert_left_index: int, reverse: bool, path: List[City],
@@ -103,34 +319,47 @@ def re_insert_path_segment(segment: Tuple[int, int], insert_left_index: int, rev
     if segment[0] > segment[1]:
         warnings.warn("Warning......The second element of the segment is larger than the first, I reversed them")
         segment = (segment[1], segment[0])
+    num_remaining = len(path) - (segment[1] - segment[0] + 1)
+    if insert_left_index >= num_remaining:
+        warnings.warn("Warning......The insert_left_index is larger than the remaining path after removal of the segment, I append the segment to the end")
+        insert_left_index = num_remaining - 1
+
+    new_length = re_insert_path_segment_length(segment, insert_left_index, reverse, path, length)
+    # Move the segment in place on an array of positions, then look up the cities
+    tour = Tour(range(len(path)))
+    tour.re_insert_segment(segment, insert_left_index, reverse)
+    return tour.path(path), new_length
 
+
+def re_insert_path_segment_length(segment: Tuple[int, int], insert_left_index: int, reverse: bool, path: List[City],
+                                  length: float) -> float:
+    """
+    The path length after re_insert_path_segment, computed in O(1) without building the new path
+    :param segment: Tuple of the indices of the segment to remove, segment[0] <= segment[1]
+    :param insert_left_index: Insert the removed segment after this index in the path after removal
+    :param reverse: bool If we want to reverse the segment
+    :param path: The original path
+    :param length: The original path length
+    :return: the new path length
+    """
+    num_cities = len(path)
+    segment_length = segment[1] - segment[0] + 1
     # Acquire the cities left and right of the segment
-    left = path[(segment[0] - 1) % len(path)]
-    right = path[(segment[1] + 1) % len(path)]
+    left = path[(segment[0] - 1) % num_cities]
+    right = path[(segment[1] + 1) % num_cities]
     # Calculate the path length after removing the segment by breaking 2 arcs and creating 1 new arc
     length_after_removal = length \
                            - left.distance_to(path[segment[0]]) \
                            - path[segment[1]].distance_to(right) \
                            + left.distance_to(right)
-    # Remove the segment from the path
-    path_after_removal = path[:segment[0]] + path[segment[1] + 1:]
-    # Acquire the segment
-    path_segment = path[segment[0]: segment[1] + 1]
-    if reverse:
-        # Reverse if needed
-        path_segment.reverse()
-
-    # Make the algorithm fool proof
-    if insert_left_index >= len(path) - (segment[1] - segment[0] + 1) + 1:
-        warnings.warn("Warning......The insert_left_index is larger than the remaining path after removal of the segment, I append the segment to the end")
-        insert_left_index = len(path) - (segment[1] - segment[0] + 1)
 
-    # Find the two indices from the path after removal where we insert our segment
-    insert_right_index = (insert_left_index + 1) % len(path_after_removal)
+    # Index k of the path after removal is index k of the path before the segment and k + segment_length after it
+    insert_right_index = (insert_left_index + 1) % (num_cities - segment_length)
+    insert_left = path[insert_left_index if insert_left_index < segment[0] else insert_left_index + segment_length]
+    insert_right = path[insert_right_index if insert_right_index < segment[0] else insert_right_index + segment_length]
+    first, last = (path[segment[1]], path[segment[0]]) if reverse else (path[segment[0]], path[segment[1]])
     # Calculate the added length by removing the arc between the left and right insert and reconnecting the arc segment
-    new_length = length_after_removal \
-                 - path_after_removal[insert_left_index].distance_to(path_after_removal[insert_right_index]) \
-                 + path_after_removal[insert_left_index].distance_to(path_segment[0]) \
-                 + path_segment[-1].distance_to(path_after_removal[insert_right_index])
-    new_path = path_after_removal[: insert_left_index + 1] + path_segment + path_after_removal[insert_right_index:]
-    return new_path, new_length
\ No newline at end of file
+    return length_after_removal \
+           - insert_left.distance_to(insert_right) \
+           + insert_left.distance_to(first) \
+           + last.distance_to(insert_right)
@@ -0,0 +1,215 @@
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple, Union
+import json
+import struct
+import numpy as np
+
+from tsp_classes import City, CityArray
+
+# Binary files start with a fixed header: magic, version, header size, number of entries, dtype, flags and the length
+# of the JSON metadata that follows it. The data starts at the header size, a multiple of 64 bytes.
+INSTANCE_MAGIC = b'TSPINST\x00'
+TOUR_MAGIC = b'TSPTOUR\x00'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<8sIIQ8sII')
+_ALIGNMENT = 64
+# Flag of instance files that store the city ids after the coordinates
+_HAS_IDS = 1
+
+
+def _read_tsplib_header(file: TextIO) -> Dict[str, str]:
+    """
+    Read the header fields of a TSPLIB file up to and including the NODE_COORD_SECTION line
+    :param file: The opened .tsp file
+    :return: The header fields (NAME, TYPE, DIMENSION, ...)
+    """
+    header = {}
+    for line in file:
+        line = line.strip()
+        if line.startswith('NODE_COORD_SECTION'):
+            break
+        if ':' in line:
+            key, value = line.split(':', 1)
+            header[key.strip()] = value.strip()
+    return header
+
+
+def _read_tsplib_coordinates(file: TextIO, chunk_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Read the NODE_COORD_SECTION of a TSPLIB file in chunks
+    :param file: The opened .tsp file, positioned after the NODE_COORD_SECTION line
+    :param chunk_size: The number of cities per chunk
+    :return: Iterator over the ids and the coordinates of each chunk
+    """
+    ids, coordinates = [], []
+    for line in file:
+        fields = line.split()
+        if not fields or fields[0] == 'EOF':
+            continue
+        if not fields[0].lstrip('-').isdigit():
+            # The next section starts, we only read the coordinates
+            break
+        ids.append(int(fields[0]))
+        coordinates.append((float(fields[1]), float(fields[2])))
+        if len(ids) == chunk_size:
+            yield np.array(ids, dtype=np.int64), np.array(coordinates, dtype=np.float64)
+            ids, coordinates = [], []
+    if ids:
+        yield np.array(ids, dtype=np.int64), np.array(coordinates, dtype=np.float64)
+
+
+def read_tsplib(file_name: str) -> Tuple[CityArray, Dict[str, str]]:
+    """
+    Read an instance in TSPLIB format with a NODE_COORD_SECTION. Distances between the cities are euclidean
+    distances as everywhere in this repository, the rounding of EUC_2D instances is not applied.
+    :param file_name: The .tsp file
+    :return: The cities with the ids from the file and the header fields (NAME, TYPE, DIMENSION, ...)
+    """
+    with open(file_name) as file:
+        header = _read_tsplib_header(file)
+        chunks = list(_read_tsplib_coordinates(file, 2 ** 16))
+    ids = np.concatenate([chunk_ids for chunk_ids, _ in chunks]) if chunks else np.empty(0, dtype=np.int64)
+    coordinates = np.concatenate([chunk for _, chunk in chunks]) if chunks else np.empty((0, 2))
+
+    if 'DIMENSION' in header and int(header['DIMENSION']) != len(ids):
+        raise ValueError(f"{file_name} has DIMENSION {header['DIMENSION']} but {len(ids)} coordinates")
+    return CityArray(coordinates, ids), header
+
+
+def _write_header(file, magic: bytes, count: int, dtype: np.dtype, flags: int, metadata: Optional[dict]) -> int:
+    """
+    Write the header of a binary file
+    :return: The header size, at which the data starts
+    """
+    metadata = json.dumps(metadata or {}).encode()
+    header_size = -(-(_HEADER.size + len(metadata)) // _ALIGNMENT) * _ALIGNMENT
+    file.write(_HEADER.pack(magic, FORMAT_VERSION, header_size, count, np.dtype(dtype).str.encode(), flags,
+                            len(metadata)))
+    file.write(metadata)
+    file.write(b'\x00' * (header_size - _HEADER.size - len(metadata)))
+    return header_size
+
+
+def _read_header(file_name: str, magic: bytes) -> Tuple[int, int, np.dtype, int, dict]:
+    """
+    Read the header of a binary file
+    :return: The header size, the number of entries, the dtype, the flags and the metadata
+    """
+    with open(file_name, 'rb') as file:
+        fields = file.read(_HEADER.size)
+        if len(fields) < _HEADER.size:
+            raise ValueError(f"{file_name} is too short for a header")
+        file_magic, version, header_size, count, dtype, flags, metadata_length = _HEADER.unpack(fields)
+        if file_magic != magic:
+            raise ValueError(f"{file_name} is not a {magic.rstrip(bytes(1)).decode()} file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{file_name} has format version {version}, expected {FORMAT_VERSION}")
+        metadata = json.loads(file.read(metadata_length).decode())
+    return header_size, count, np.dtype(dtype.rstrip(b'\x00').decode()), flags, metadata
+
+
+def write_instance(file_name: str, cities: Union[List[City], CityArray, np.ndarray], dtype: np.dtype = np.float64,
+                   metadata: Optional[dict] = None):
+    """
+    Write an instance in the binary format: the header, the coordinates as an (n, 2) array and, if the cities have
+    ids that differ from their index, the ids as int64
+    :param file_name: The output file
+    :param cities: A list of cities, a CityArray or an array with the x and y coordinate of each city
+    :param dtype: np.float32 or np.float64, the precision of the stored coordinates
+    :param metadata: Values stored with the instance, such as the TSPLIB header
+    """
+    ids = None
+    if not isinstance(cities, np.ndarray):
+        cities = CityArray.from_cities(cities)
+    if isinstance(cities, CityArray):
+        if not np.array_equal(cities.ids, np.arange(len(cities))):
+            ids = cities.ids
+        cities = cities.coordinates
+    coordinates = np.ascontiguousarray(cities, dtype=dtype).reshape(-1, 2)
+    with open(file_name, 'wb') as file:
+        _write_header(file, INSTANCE_MAGIC, len(coordinates), coordinates.dtype, 0 if ids is None else _HAS_IDS,
+                      metadata)
+        file.write(coordinates.tobytes())
+        if ids is not None:
+            file.write(np.ascontiguousarray(ids, dtype='<i8').tobytes())
+
+
+def read_instance(file_name: str, mode: str = 'r') -> Tuple[CityArray, dict]:
+    """
+    Open an instance in the binary format without reading it: the coordinates are memory mapped, so the operating
+    system loads the pages on access and shares them between processes that open the same file
+    :param file_name: The instance file
+    :param mode: Mode of np.memmap, 'r' for read only, 'r+' to change the file or 'c' for copy on write
+    :return: The cities, backed by the file, and the metadata
+    """
+    header_size, num_cities, dtype, flags, metadata = _read_header(file_name, INSTANCE_MAGIC)
+    if num_cities == 0:
+        return CityArray(np.empty((0, 2), dtype=dtype)), metadata
+    coordinates = np.memmap(file_name, dtype=dtype, mode=mode, offset=header_size, shape=(num_cities, 2))
+    ids = None
+    if flags & _HAS_IDS:
+        ids = np.memmap(file_name, dtype='<i8', mode=mode, offset=header_size + coordinates.nbytes,
+                        shape=(num_cities,))
+    return CityArray(coordinates, ids), metadata
+
+
+def write_tour(file_name: str, order: Union[np.ndarray, List[int]], metadata: Optional[dict] = None):
+    """
+    Write a tour as an int32 permutation in the binary format
+    :param file_name: The output file
+    :param order: Indices of the cities in the order in which they are visited, e.g. from
+    tsp_general_functions.path_indices
+    :param metadata: Values stored with the tour, such as its length
+    """
+    order = np.ascontiguousarray(order, dtype='<i4')
+    with open(file_name, 'wb') as file:
+        _write_header(file, TOUR_MAGIC, len(order), order.dtype, 0, metadata)
+        file.write(order.tobytes())
+
+
+def read_tour(file_name: str, mode: str = 'r') -> Tuple[np.ndarray, dict]:
+    """
+    Open a tour in the binary format as a memory mapped array
+    :param file_name: The tour file
+    :param mode: Mode of np.memmap
+    :return: The order of the cities and the metadata
+    """
+    header_size, num_cities, dtype, _, metadata = _read_header(file_name, TOUR_MAGIC)
+    if num_cities == 0:
+        return np.empty(0, dtype=dtype), metadata
+    return np.memmap(file_name, dtype=dtype, mode=mode, offset=header_size, shape=(num_cities,)), metadata
+
+
+def convert_tsplib(tsp_file_name: str, file_name: str, dtype: np.dtype = np.float64, chunk_size: int = 2 ** 16):
+    """
+    Convert a TSPLIB file into the binary instance format without holding the instance in memory: the coordinates
+    are parsed in chunks and written into the memory mapped output file
+    :param tsp_file_name: The .tsp file, it needs a DIMENSION field
+    :param file_name: The output file
+    :param dtype: np.float32 or np.float64, the precision of the stored coordinates
+    :param chunk_size: The number of cities parsed at once
+    """
+    with open(tsp_file_name) as file:
+        header = _read_tsplib_header(file)
+        if 'DIMENSION' not in header:
+            raise ValueError(f"{tsp_file_name} has no DIMENSION")
+        num_cities = int(header['DIMENSION'])
+        with open(file_name, 'wb') as output:
+            header_size = _write_header(output, INSTANCE_MAGIC, num_cities, np.dtype(dtype), _HAS_IDS, header)
+            output.truncate(header_size + num_cities * (2 * np.dtype(dtype).itemsize + 8))
+        if num_cities == 0:
+            return
+        coordinates = np.memmap(file_name, dtype=dtype, mode='r+', offset=header_size, shape=(num_cities, 2))
+        ids = np.memmap(file_name, dtype='<i8', mode='r+', offset=header_size + coordinates.nbytes,
+                        shape=(num_cities,))
+        num_read = 0
+        for chunk_ids, chunk in _read_tsplib_coordinates(file, chunk_size):
+            if num_read + len(chunk) > num_cities:
+                raise ValueError(f"{tsp_file_name} has DIMENSION {num_cities} but more coordinates")
+            coordinates[num_read: num_read + len(chunk)] = chunk
+            ids[num_read: num_read + len(chunk)] = chunk_ids
+            num_read += len(chunk)
+        coordinates.flush()
+        ids.flush()
+        del coordinates, ids
+    if num_read != num_cities:
+        raise ValueError(f"{tsp_file_name} has DIMENSION {num_cities} but {num_read} coordinates")
@@ -0,0 +1,227 @@
+from typing import Optional, Tuple
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Without numba the move evaluation falls back to array operations, which give the same results
+HAVE_NUMBA = numba is not None
+
+# Kinds of moves returned by the compiled kernel
+_NO_MOVE, _SEGMENT, _TWO_OPT = 0, 1, 2
+
+
+def _jit(function):
+    if HAVE_NUMBA:
+        return numba.njit(cache=True)(function)
+    return function
+
+
+@_jit
+def _distance(x: np.ndarray, y: np.ndarray, city1: int, city2: int) -> float:
+    return np.sqrt((x[city1] - x[city2]) ** 2 + (y[city1] - y[city2]) ** 2)
+
+
+def _candidate_move_loop(x: np.ndarray, y: np.ndarray, order: np.ndarray, position_of: np.ndarray,
+                         arc_lengths: np.ndarray, neighbours: np.ndarray, position: int, max_segment_length: int,
+                         two_opt: bool):
+    """
+    Scalar version of _candidate_move_numpy that visits the moves in the same order, compiled by numba if available
+    :return: The change in length, the kind of move, its three integer arguments, whether the segment is reversed, the
+    number of moves evaluated and the number of distances computed
+    """
+    num_cities = len(order)
+    k = neighbours.shape[1]
+    best_delta, best_kind, best_a, best_b, best_c, best_reverse = np.inf, _NO_MOVE, 0, 0, 0, False
+    evaluated = 0
+    distance_evaluations = 0
+
+    # Segments that start with the city and segments that end with it
+    num_options = 0
+    starts = np.empty(2 * max(max_segment_length, 0), dtype=np.int64)
+    segment_lengths = np.empty(2 * max(max_segment_length, 0), dtype=np.int64)
+    for segment_length in range(1, min(max_segment_length, num_cities - 3) + 1):
+        starts[num_options] = position % num_cities
+        segment_lengths[num_options] = segment_length
+        num_options += 1
+        if segment_length > 1:
+            starts[num_options] = (position - segment_length + 1) % num_cities
+            segment_lengths[num_options] = segment_length
+            num_options += 1
+
+    if num_options > 0:
+        removal_gains = np.empty(num_options)
+        distance_evaluations += 3 * num_options
+        for option in range(num_options):
+            start, segment_length = starts[option], segment_lengths[option]
+            end = (start + segment_length - 1) % num_cities
+            previous_city, first = order[(start - 1) % num_cities], order[start]
+            last, next_city = order[end], order[(end + 1) % num_cities]
+            removal_gains[option] = _distance(x, y, previous_city, first) + _distance(x, y, last, next_city) \
+                - _distance(x, y, previous_city, next_city)
+
+        for reverse in (False, True):
+            for option in range(num_options):
+                start, segment_length = starts[option], segment_lengths[option]
+                first, last = order[start], order[(start + segment_length - 1) % num_cities]
+                # Insertion arcs that start or end at a candidate of the first or last city of the segment
+                for index in range(4 * k):
+                    column = index % (2 * k)
+                    candidate = neighbours[first, column] if column < k else neighbours[last, column - k]
+                    arc = (position_of[candidate] - (1 if index >= 2 * k else 0)) % num_cities
+                    # Arcs that touch the segment are no insertion positions
+                    if (arc - start + 1) % num_cities <= segment_length:
+                        continue
+                    if not reverse:
+                        evaluated += 2
+                    distance_evaluations += 2
+                    arc_start, arc_end = order[arc], order[(arc + 1) % num_cities]
+                    if reverse:
+                        delta = _distance(x, y, arc_start, last) + _distance(x, y, first, arc_end) \
+                            - (arc_lengths[arc] + removal_gains[option])
+                    else:
+                        delta = _distance(x, y, arc_start, first) + _distance(x, y, last, arc_end) \
+                            - (arc_lengths[arc] + removal_gains[option])
+                    if delta < best_delta:
+                        best_delta, best_kind, best_reverse = delta, _SEGMENT, reverse
+                        best_a, best_b, best_c = start, segment_length, arc
+
+    if two_opt and num_cities >= 5:
+        # Remove the arc at arc_position and the arc at arc, creating city-c and next_city-e, where c is a candidate
+        # of city or e is a candidate of next_city
+        for option in range(2):
+            arc_position = (position - option) % num_cities
+            city, next_city = order[arc_position], order[(arc_position + 1) % num_cities]
+            for index in range(2 * k):
+                if index < k:
+                    arc = position_of[neighbours[city, index]] % num_cities
+                else:
+                    arc = (position_of[neighbours[next_city, index - k]] - 1) % num_cities
+                if (arc - arc_position + 1) % num_cities <= 2:
+                    continue
+                evaluated += 1
+                distance_evaluations += 2
+                arc_end = order[(arc + 1) % num_cities]
+                delta = _distance(x, y, order[arc], city) + _distance(x, y, arc_end, next_city) \
+                    - arc_lengths[arc_position] - arc_lengths[arc]
+                if delta < best_delta:
+                    best_delta, best_kind, best_reverse = delta, _TWO_OPT, False
+                    best_a, best_b, best_c = arc_position, arc, 0
+    return best_delta, best_kind, best_a, best_b, best_c, best_reverse, evaluated, distance_evaluations
+
+
+_candidate_move_compiled = _jit(_candidate_move_loop)
+
+
+def _candidate_move_numpy(x: np.ndarray, y: np.ndarray, order: np.ndarray, position_of: np.ndarray,
+                          arc_lengths: np.ndarray, neighbours: np.ndarray, position: int, max_segment_length: int,
+                          two_opt: bool) -> Tuple[float, Optional[tuple], int, int]:
+    """
+    Array version of best_candidate_move, all segments and both arcs of the city are evaluated together in one set of
+    array operations
+    """
+    num_cities = len(order)
+
+    def distances(cities1, cities2):
+        return np.sqrt((x[cities1] - x[cities2]) ** 2 + (y[cities1] - y[cities2]) ** 2)
+
+    best_delta, best_move, evaluated, distance_evaluations = np.inf, None, 0, 0
+
+    # Segments that start with the city and segments that end with it
+    starts, segment_lengths = [], []
+    for segment_length in range(1, min(max_segment_length, num_cities - 3) + 1):
+        starts.append(position)
+        segment_lengths.append(segment_length)
+        if segment_length > 1:
+            starts.append(position - segment_length + 1)
+            segment_lengths.append(segment_length)
+    if starts:
+        starts = np.array(starts) % num_cities
+        segment_lengths = np.array(segment_lengths)
+        ends = (starts + segment_lengths - 1) % num_cities
+        first, last = order[starts], order[ends]
+        previous_city, next_city = order[starts - 1], order[(ends + 1) % num_cities]
+        removal_gain = distances(previous_city, first) + distances(last, next_city) \
+            - distances(previous_city, next_city)
+        # Insertion arcs that start or end at a candidate of the first or last city of the segment
+        positions = position_of[np.hstack((neighbours[first], neighbours[last]))]
+        arcs = np.hstack((positions, positions - 1)) % num_cities
+        arc_start, arc_end = order[arcs], order[(arcs + 1) % num_cities]
+        insertion_base = arc_lengths[arcs] + removal_gain[:, np.newaxis]
+        forward = distances(arc_start, first[:, np.newaxis]) + distances(last[:, np.newaxis], arc_end) \
+            - insertion_base
+        backward = distances(arc_start, last[:, np.newaxis]) + distances(first[:, np.newaxis], arc_end) \
+            - insertion_base
+        # Arcs that touch the segment are no insertion positions
+        touching = (arcs - starts[:, np.newaxis] + 1) % num_cities <= segment_lengths[:, np.newaxis]
+        forward[touching] = np.inf
+        backward[touching] = np.inf
+        evaluated += 2 * int((~touching).sum())
+        # Count the distances of the evaluated moves only, as the scalar kernel does
+        distance_evaluations += 3 * len(starts) + 4 * int((~touching).sum())
+        for deltas, reverse in ((forward, False), (backward, True)):
+            option, arc = np.unravel_index(np.argmin(deltas), deltas.shape)
+            if deltas[option, arc] < best_delta:
+                best_delta = deltas[option, arc]
+                best_move = ('segment', int(starts[option]), int(segment_lengths[option]), int(arcs[option, arc]),
+                             reverse)
+
+    if two_opt and num_cities >= 5:
+        # Remove the arc at arc_positions and the arc at arcs, creating city-c and next_city-e, where c is a
+        # candidate of city or e is a candidate of next_city
+        arc_positions = np.array([position, position - 1]) % num_cities
+        city, next_city = order[arc_positions], order[(arc_positions + 1) % num_cities]
+        arcs = np.hstack((position_of[neighbours[city]], position_of[neighbours[next_city]] - 1)) % num_cities
+        deltas = distances(order[arcs], city[:, np.newaxis]) \
+            + distances(order[(arcs + 1) % num_cities], next_city[:, np.newaxis]) \
+            - arc_lengths[arc_positions][:, np.newaxis] - arc_lengths[arcs]
+        adjacent = (arcs - arc_positions[:, np.newaxis] + 1) % num_cities <= 2
+        deltas[adjacent] = np.inf
+        evaluated += int((~adjacent).sum())
+        distance_evaluations += 2 * int((~adjacent).sum())
+        option, arc = np.unravel_index(np.argmin(deltas), deltas.shape)
+        if deltas[option, arc] < best_delta:
+            best_delta = deltas[option, arc]
+            best_move = ('two_opt', int(arc_positions[option]), int(arcs[option, arc]))
+    return float(best_delta), best_move, evaluated, distance_evaluations
+
+
+def best_candidate_move(x: np.ndarray, y: np.ndarray, order: np.ndarray, position_of: np.ndarray,
+                        arc_lengths: np.ndarray, neighbours: np.ndarray, position: int, max_segment_length: int,
+                        two_opt: bool = True,
+                        compiled: Optional[bool] = None) -> Tuple[float, Optional[tuple], int, int]:
+    """
+    Best Or-opt move (a segment of at most max_segment_length cities starting or ending at the city at position,
+    re-inserted with or without reversal) or 2-opt move (on one of the two arcs of the city) that creates an arc to a
+    candidate neighbour. Ties are broken the same way by the compiled kernel and the array version.
+    :param x: x coordinate of each city
+    :param y: y coordinate of each city
+    :param order: Indices of the cities in the order in which they are visited
+    :param position_of: Position of each city in order
+    :param arc_lengths: Length of the arc from each position to the next one
+    :param neighbours: Candidate lists from tsp_local_search.candidate_lists()
+    :param position: Position of the city around which moves are evaluated
+    :param max_segment_length: The longest segment that is moved
+    :param two_opt: Also evaluate 2-opt moves
+    :param compiled: Use the scalar kernel instead of the array version, by default if numba is installed. The scalar
+    kernel runs in plain Python without numba
+    :return: The change in length, the move as in DeltaLocalSearch (None if there is no move), the number of moves
+    evaluated and the number of distances computed
+    """
+    if compiled is None:
+        compiled = HAVE_NUMBA
+    if not compiled:
+        return _candidate_move_numpy(x, y, order, position_of, arc_lengths, neighbours, position, max_segment_length,
+                                     two_opt)
+
+    delta, kind, a, b, c, reverse, evaluated, distance_evaluations = _candidate_move_compiled(
+        x, y, order, position_of, arc_lengths, neighbours, position, max_segment_length, two_opt)
+    if kind == _SEGMENT:
+        move = ('segment', int(a), int(b), int(c), bool(reverse))
+    elif kind == _TWO_OPT:
+        move = ('two_opt', int(a), int(b))
+    else:
+        move = None
+    return float(delta), move, int(evaluated), int(distance_evaluations)
@@ -0,0 +1,465 @@
+from collections import deque
+from typing import Callable, List, Tuple, Optional
+import time
+import numpy as np
+
+import tsp_kernels
+import tsp_profiling
+from tsp_classes import CityArray, Tour
+from tsp_spatial import SpatialGrid
+
+# A move is only accepted if it shortens the path by more than this
+IMPROVEMENT_THRESHOLD = 0.0001
+
+
+def candidate_lists(coordinates: np.ndarray, k: int) -> np.ndarray:
+    """
+    Find the k nearest other cities of each city
+    :param coordinates: Array with the x and y coordinate of each city
+    :param k: The number of neighbours per city
+    :return: Array of shape (n, k) with the indices of the neighbours of each city, nearest first
+    """
+    num_cities = len(coordinates)
+    k = min(k, num_cities - 1)
+    grid = SpatialGrid(CityArray(coordinates))
+    neighbours = np.empty((num_cities, k), dtype=np.intp)
+    for city in range(num_cities):
+        neighbours[city] = _nearest_other_cities(grid, city, k)
+    stats = tsp_profiling.current()
+    if stats is not None:
+        stats.count('distance_evaluations', grid.distance_evaluations)
+    return neighbours
+
+
+def _nearest_other_cities(grid: SpatialGrid, city: int, k: int) -> np.ndarray:
+    nearest, _ = grid.nearest(grid.x[city], grid.y[city], k + 1)
+    return nearest[nearest != city][:k]
+
+
+class DeltaLocalSearch:
+    def __init__(self, coordinates: np.ndarray, order: np.ndarray, max_segment_length: int = 3,
+                 two_opt: bool = True, neighbours: Optional[np.ndarray] = None, compiled: Optional[bool] = None):
+        """
+        Or-opt and 2-opt local search that evaluates moves by their change in path length. For a city, all insertion
+        positions of the segments starting or ending at it (and all 2-opt moves on its two edges) are evaluated in one
+        array operation, the tour is only changed (in place) when a move is accepted.
+        Don't look bits: a city is only evaluated again after one of its edges changed.
+        :param coordinates: Array with the x and y coordinate of each city
+        :param order: Indices of the cities in the order in which they are visited
+        :param max_segment_length: The longest segment that is moved by Or-opt
+        :param two_opt: Also apply 2-opt moves
+        :param neighbours: Candidate lists from candidate_lists(), if given only moves that create an arc to one of
+        the candidates are evaluated instead of all positions on the path
+        :param compiled: Evaluate candidate moves with the scalar kernel of tsp_kernels instead of its array version,
+        by default if numba is installed. Both give the same moves
+        """
+        self.coordinates = np.asarray(coordinates, dtype=np.float64)
+        self.x = np.ascontiguousarray(self.coordinates[:, 0])
+        self.y = np.ascontiguousarray(self.coordinates[:, 1])
+        self.tour = Tour(order)
+        # The tour changes these arrays in place
+        self.order = self.tour.order
+        self.position = self.tour.position
+        self.max_segment_length = max_segment_length
+        self.two_opt = two_opt
+        self.neighbours = neighbours
+        self.compiled = compiled
+        self.moves_evaluated = 0
+        self.moves_accepted = 0
+        self.distance_evaluations = len(self.order)
+        self.path_x = self.coordinates[self.order, 0]
+        self.path_y = self.coordinates[self.order, 1]
+        self.arc_lengths = np.sqrt((np.roll(self.path_x, -1) - self.path_x) ** 2 +
+                                   (np.roll(self.path_y, -1) - self.path_y) ** 2)
+        # Kept up to date with the change in length of each accepted move
+        self.current_length = self.length()
+
+    def _update_positions(self, positions: np.ndarray):
+        """
+        Refresh the coordinates and arc lengths in path order at the positions that changed
+        """
+        cities = self.order[positions]
+        self.path_x[positions] = self.coordinates[cities, 0]
+        self.path_y[positions] = self.coordinates[cities, 1]
+        arcs = np.unique(np.concatenate((positions, positions - 1)) % len(self.order))
+        self.arc_lengths[arcs] = self._distances(self.order[arcs], self.order[(arcs + 1) % len(self.order)])
+
+    def _distance(self, city1: int, city2: int) -> float:
+        self.distance_evaluations += 1
+        return np.sqrt((self.coordinates[city1, 0] - self.coordinates[city2, 0]) ** 2 +
+                       (self.coordinates[city1, 1] - self.coordinates[city2, 1]) ** 2)
+
+    def _distances_to_path(self, city: int) -> np.ndarray:
+        self.distance_evaluations += len(self.path_x)
+        return np.sqrt((self.path_x - self.coordinates[city, 0]) ** 2 + (self.path_y - self.coordinates[city, 1]) ** 2)
+
+    def _distances(self, cities1: np.ndarray, cities2: np.ndarray) -> np.ndarray:
+        self.distance_evaluations += np.size(cities1)
+        return np.sqrt((self.coordinates[cities1, 0] - self.coordinates[cities2, 0]) ** 2 +
+                       (self.coordinates[cities1, 1] - self.coordinates[cities2, 1]) ** 2)
+
+    def length(self) -> float:
+        return self.arc_lengths.sum()
+
+    def _best_segment_move(self, start: int, end: int) -> Tuple[float, Optional[tuple]]:
+        """
+        Best position to re-insert the segment between positions start and end (inclusive, possibly wrapping around)
+        :return: The change in length and the move
+        """
+        num_cities = len(self.tour)
+        tour = self.order
+        segment_length = (end - start) % num_cities + 1
+        if segment_length > num_cities - 3:
+            return 0., None
+        previous_city, first, last, next_city = \
+            tour[start - 1], tour[start], tour[end], tour[(end + 1) % num_cities]
+        removal_gain = self._distance(previous_city, first) + self._distance(last, next_city) \
+            - self._distance(previous_city, next_city)
+
+        to_first = self._distances_to_path(first)
+        to_last = self._distances_to_path(last)
+        # Insert between position k and k + 1, either as c-first...last-e or as c-last...first-e
+        forward = to_first + np.roll(to_last, -1) - self.arc_lengths - removal_gain
+        backward = to_last + np.roll(to_first, -1) - self.arc_lengths - removal_gain
+        # Arcs that touch the segment are no insertion positions
+        touching = (np.arange(start - 1, start + segment_length)) % num_cities
+        forward[touching] = np.inf
+        backward[touching] = np.inf
+        self.moves_evaluated += 2 * (num_cities - segment_length - 1)
+
+        best_forward, best_backward = int(np.argmin(forward)), int(np.argmin(backward))
+        if forward[best_forward] <= backward[best_backward]:
+            return forward[best_forward], ('segment', start, segment_length, best_forward, False)
+        return backward[best_backward], ('segment', start, segment_length, best_backward, True)
+
+    def _best_two_opt_move(self, position: int) -> Tuple[float, Optional[tuple]]:
+        """
+        Best 2-opt move that removes the arc from position to position + 1
+        :return: The change in length and the move
+        """
+        num_cities = len(self.tour)
+        if num_cities < 5:
+            return 0., None
+        next_position = (position + 1) % num_cities
+        deltas = self._distances_to_path(self.order[position]) \
+            + np.roll(self._distances_to_path(self.order[next_position]), -1) \
+            - self.arc_lengths[position] - self.arc_lengths
+        deltas[[position - 1, position, next_position]] = np.inf
+        self.moves_evaluated += num_cities - 3
+        best = int(np.argmin(deltas))
+        return deltas[best], ('two_opt', position, best)
+
+    def _best_candidate_move(self, position: int) -> Tuple[float, Optional[tuple]]:
+        """
+        Best Or-opt or 2-opt move around the city at position that creates an arc to a candidate neighbour, evaluated
+        by the kernel in tsp_kernels (compiled with numba if it is installed)
+        :return: The change in length and the move
+        """
+        delta, move, evaluated, distance_evaluations = tsp_kernels.best_candidate_move(
+            self.x, self.y, self.order, self.position, self.arc_lengths, self.neighbours, position,
+            self.max_segment_length, self.two_opt, self.compiled)
+        self.moves_evaluated += evaluated
+        self.distance_evaluations += distance_evaluations
+        return delta, move
+
+    def _apply(self, move: tuple) -> List[int]:
+        """
+        Apply an accepted move to the tour in place
+        :return: The cities whose arcs changed
+        """
+        tour = self.order
+        num_cities = len(tour)
+        if move[0] == 'segment':
+            _, start, segment_length, insert_position, reverse = move
+            insert_left = tour[insert_position]
+            changed = [tour[start - 1], tour[start], tour[(start + segment_length - 1) % num_cities],
+                       tour[(start + segment_length) % num_cities], insert_left,
+                       tour[(insert_position + 1) % num_cities]]
+            positions = self.tour.move_segment(start, segment_length, insert_position, reverse)
+        else:
+            _, position1, position2 = move
+            position1, position2 = min(position1, position2), max(position1, position2)
+            changed = [tour[position1], tour[position1 + 1], tour[position2], tour[(position2 + 1) % num_cities]]
+            positions = self.tour.reverse(position1 + 1, position2)
+        self._update_positions(positions)
+        self.moves_accepted += 1
+        return changed
+
+    def improve_city(self, city: int) -> Optional[List[int]]:
+        """
+        Apply the best improving move around a city
+        :param city: The city to evaluate
+        :return: The cities whose arcs changed or None if no improving move exists
+        """
+        num_cities = len(self.tour)
+        position = int(self.position[city])
+        best_delta, best_move = -IMPROVEMENT_THRESHOLD, None
+        if self.neighbours is not None:
+            candidates = [self._best_candidate_move(position)]
+        else:
+            candidates = self._full_neighbourhood_moves(position)
+        for delta, move in candidates:
+            if move is not None and delta < best_delta:
+                best_delta, best_move = delta, move
+        if best_move is None:
+            return None
+        self.current_length += best_delta
+        return self._apply(best_move)
+
+    def _full_neighbourhood_moves(self, position: int) -> List[Tuple[float, Optional[tuple]]]:
+        """
+        Best move for each segment starting or ending at position and each arc of the city, over the whole path
+        """
+        num_cities = len(self.tour)
+        candidates = []
+        for segment_length in range(1, self.max_segment_length + 1):
+            # Segments that start with the city and segments that end with it
+            candidates.append(self._best_segment_move(position, (position + segment_length - 1) % num_cities))
+            if segment_length > 1:
+                candidates.append(self._best_segment_move((position - segment_length + 1) % num_cities, position))
+        if self.two_opt:
+            candidates.append(self._best_two_opt_move(position))
+            candidates.append(self._best_two_opt_move((position - 1) % num_cities))
+        return candidates
+
+    def run(self, active: Optional[List[int]] = None, deadline: Optional[float] = None,
+            callback: Optional[Callable[[float], None]] = None) -> np.ndarray:
+        """
+        Improve the path until no city has an improving move
+        :param active: The cities whose don't look bit is initially off, by default all cities
+        :param deadline: Stop when time.time() passes this moment, the path is valid at any time
+        :param callback: Called with the new path length after every accepted move
+        :return: The improved order of the cities
+        """
+        stats = tsp_profiling.current()
+        moves_evaluated, moves_accepted = self.moves_evaluated, self.moves_accepted
+        distance_evaluations = self.distance_evaluations
+        queue = deque(self.order.tolist() if active is None else active)
+        in_queue = np.zeros(len(self.coordinates), dtype=bool)
+        in_queue[list(queue)] = True
+        while queue:
+            if deadline is not None and time.time() >= deadline:
+                break
+            city = queue.popleft()
+            in_queue[city] = False
+            changed = self.improve_city(city)
+            if changed is not None:
+                if callback is not None:
+                    callback(self.current_length)
+                # The neighbourhood of these cities changed, switch their don't look bits off
+                for other in [city] + changed:
+                    if not in_queue[other]:
+                        in_queue[other] = True
+                        queue.append(other)
+        if stats is not None:
+            stats.count('moves_evaluated', self.moves_evaluated - moves_evaluated)
+            stats.count('moves_accepted', self.moves_accepted - moves_accepted)
+            stats.count('distance_evaluations', self.distance_evaluations - distance_evaluations)
+            stats.log('local_search_run', search=type(self).__name__,
+                      moves_evaluated=self.moves_evaluated - moves_evaluated,
+                      moves_accepted=self.moves_accepted - moves_accepted, length=self.current_length)
+        return self.order
+
+
+class LazyCandidateSearch(DeltaLocalSearch):
+    def __init__(self, coordinates: np.ndarray, order: np.ndarray, max_segment_length: int = 3,
+                 two_opt: bool = True, k: int = 8, compiled: Optional[bool] = None):
+        """
+        DeltaLocalSearch restricted to the k nearest neighbours, where the candidate list of a city is only computed
+        when a move around it is evaluated. A search that starts from a few active cities, e.g. after a small change
+        of the instance, then costs time in proportion to the region it changes instead of the number of cities.
+        :param coordinates: Array with the x and y coordinate of each city
+        :param order: Indices of the cities in the order in which they are visited
+        :param max_segment_length: The longest segment that is moved by Or-opt
+        :param two_opt: Also apply 2-opt moves
+        :param k: The number of candidate neighbours per city
+        :param compiled: See DeltaLocalSearch
+        """
+        coordinates = np.asarray(coordinates, dtype=np.float64)
+        self.k = max(min(k, len(coordinates) - 1), 0)
+        super().__init__(coordinates, order, max_segment_length, two_opt,
+                         np.empty((len(coordinates), self.k), dtype=np.intp), compiled)
+        self.known = np.zeros(len(coordinates), dtype=bool)
+        self.grid = SpatialGrid(CityArray(self.coordinates))
+
+    def _best_candidate_move(self, position: int) -> Tuple[float, Optional[tuple]]:
+        # The moves around position read the candidate lists of the cities up to max_segment_length positions away
+        reach = max(self.max_segment_length, 1)
+        cities = self.order[np.arange(position - reach, position + reach + 1) % len(self.tour)]
+        for city in cities[~self.known[cities]].tolist():
+            self.neighbours[city] = _nearest_other_cities(self.grid, city, self.k)
+            self.known[city] = True
+        return super()._best_candidate_move(position)
+
+
+class VariableNeighbourhoodDescent(DeltaLocalSearch):
+    def __init__(self, coordinates: np.ndarray, order: np.ndarray, max_segment_length: int = 3,
+                 neighbours: Optional[np.ndarray] = None, lk_depth: int = 0, compiled: Optional[bool] = None):
+        """
+        Variable neighbourhood descent over 2-opt and Or-opt, optionally followed by a simplified Lin-Kernighan
+        neighbourhood. A neighbourhood is searched with the don't look bits of DeltaLocalSearch until no city
+        improves, after which the next one is searched. If a later neighbourhood improves the path, the search returns
+        to the first neighbourhood, starting from the cities whose arcs changed.
+        The Lin-Kernighan move is a chain of at most lk_depth 2-opt moves: each step breaks the arc that the previous
+        step closed and adds an arc to a candidate neighbour, as long as the gain without the closing arc stays
+        positive. The chain is rolled back to its best prefix.
+        :param coordinates: Array with the x and y coordinate of each city
+        :param order: Indices of the cities in the order in which they are visited
+        :param max_segment_length: The longest segment that is moved by Or-opt
+        :param neighbours: Candidate lists from candidate_lists(), required for the Lin-Kernighan neighbourhood
+        :param lk_depth: The maximum number of 2-opt moves in a Lin-Kernighan chain, 0 to skip the neighbourhood
+        :param compiled: See DeltaLocalSearch
+        """
+        if lk_depth > 0 and neighbours is None:
+            raise ValueError("The Lin-Kernighan neighbourhood needs candidate lists")
+        super().__init__(coordinates, order, max_segment_length, True, neighbours, compiled)
+        # (max_segment_length, two_opt, Lin-Kernighan) of each neighbourhood, in the order in which they are searched
+        self.neighbourhoods = [(0, True, False), (max_segment_length, False, False)]
+        if lk_depth > 0:
+            self.neighbourhoods.append((0, False, True))
+        self.lk_depth = lk_depth
+        self.lin_kernighan = False
+        self.changed = set()
+
+    def improve_city(self, city: int) -> Optional[List[int]]:
+        if self.lin_kernighan:
+            changed = self._lin_kernighan_step(city)
+        else:
+            changed = super().improve_city(city)
+        if changed is not None:
+            self.changed.update(changed)
+        return changed
+
+    def _exchange(self, a: int, b: int, c: int, d: int) -> float:
+        """
+        2-opt move that replaces the arcs a-b and c-d by a-c and b-d, where b follows a in the same direction as d
+        follows c
+        :return: The change in length
+        """
+        change = self._distance(a, c) + self._distance(b, d) - self._distance(a, b) - self._distance(c, d)
+        if self.tour.next(a) == b:
+            # a b ... c d -> a c ... b d
+            positions = self.tour.reverse(self.position[b], self.position[c])
+        else:
+            # d c ... b a -> d b ... c a
+            positions = self.tour.reverse(self.position[c], self.position[b])
+        self._update_positions(positions)
+        self.current_length += change
+        return change
+
+    def _lin_kernighan_step(self, t1: int) -> Optional[List[int]]:
+        """
+        Apply the best prefix of a chain of 2-opt moves that starts by breaking one of the arcs of t1
+        :param t1: The city to evaluate
+        :return: The cities whose arcs changed or None if no improving chain was found
+        """
+        if len(self.tour) < 8:
+            return None
+        for t2 in (self.tour.next(t1), self.tour.previous(t1)):
+            steps = []
+            added = set()
+            change, best_change, best_depth = 0., -IMPROVEMENT_THRESHOLD, 0
+            while len(steps) < self.lk_depth:
+                forward = self.tour.next(t1) == t2
+                # The gain of the chain if the closing arc t1-t2 is broken as well
+                open_gain = self._distance(t1, t2) - change
+                best_x, best_c, best_gain = None, None, -np.inf
+                for x in self.neighbours[t2].tolist():
+                    added_length = self._distance(t2, x)
+                    if added_length >= open_gain:
+                        # The candidates are sorted on distance, none of the others has a positive gain either
+                        break
+                    # Breaking c-x, where c lies on the side of x such that the result is a tour again
+                    c = self.tour.previous(x) if forward else self.tour.next(x)
+                    if x == t1 or c == t2 or (min(c, x), max(c, x)) in added:
+                        continue
+                    self.moves_evaluated += 1
+                    gain = self._distance(c, x) - added_length
+                    if gain > best_gain:
+                        best_x, best_c, best_gain = x, c, gain
+                if best_x is None:
+                    break
+                change += self._exchange(t1, t2, best_c, best_x)
+                steps.append((t2, best_c, best_x))
+                added.update(((min(t2, best_x), max(t2, best_x)), (min(t1, best_c), max(t1, best_c))))
+                if change < best_change:
+                    best_change, best_depth = change, len(steps)
+                # The new closing arc is t1-c
+                t2 = best_c
+
+            # Roll back the steps after the best prefix
+            for t2, c, x in reversed(steps[best_depth:]):
+                self._exchange(t1, c, t2, x)
+            if best_depth > 0:
+                self.moves_accepted += best_depth
+                return [t1] + [city for step in steps[:best_depth] for city in step]
+        return None
+
+    def descend(self, deadline: Optional[float] = None, callback: Optional[Callable[[float], None]] = None) \
+            -> np.ndarray:
+        """
+        Search the neighbourhoods until the path is locally optimal in all of them
+        :param deadline: Stop when time.time() passes this moment, the path is valid at any time
+        :param callback: Called with the new path length after every accepted move
+        :return: The improved order of the cities
+        """
+        num_cities = len(self.coordinates)
+        # The cities that still need to be evaluated in each neighbourhood
+        dirty = [np.ones(num_cities, dtype=bool) for _ in self.neighbourhoods]
+        index = 0
+        while index < len(self.neighbourhoods):
+            if deadline is not None and time.time() >= deadline:
+                break
+            if not dirty[index].any():
+                index += 1
+                continue
+            self.max_segment_length, self.two_opt, self.lin_kernighan = self.neighbourhoods[index]
+            self.changed = set()
+            self.run(self.order[dirty[index][self.order]].tolist(), deadline, callback)
+            dirty[index][:] = False
+            if self.changed:
+                changed = list(self.changed)
+                for other, other_dirty in enumerate(dirty):
+                    if other != index:
+                        other_dirty[changed] = True
+                index = 0 if index > 0 else 1
+            else:
+                index += 1
+        return self.order
+
+
+def improve_order_vnd(coordinates: np.ndarray, order: np.ndarray, max_segment_length: int = 3,
+                      neighbours: Optional[int] = 8, lk_depth: int = 0,
+                      deadline: Optional[float] = None) -> Tuple[np.ndarray, float]:
+    """
+    Improve a path with a variable neighbourhood descent over 2-opt, Or-opt and optionally Lin-Kernighan moves
+    :param coordinates: Array with the x and y coordinate of each city
+    :param order: Indices of the cities in the order in which they are visited
+    :param max_segment_length: The longest segment that is moved by Or-opt
+    :param neighbours: Only evaluate moves that connect a city to one of its k nearest neighbours, None for all moves
+    (not possible with Lin-Kernighan moves)
+    :param lk_depth: The maximum number of 2-opt moves in a Lin-Kernighan chain, 0 for no Lin-Kernighan moves
+    :param deadline: Stop when time.time() passes this moment
+    :return: The improved order and its length
+    """
+    candidates = None if neighbours is None else candidate_lists(coordinates, neighbours)
+    search = VariableNeighbourhoodDescent(coordinates, order, max_segment_length, candidates, lk_depth)
+    search.descend(deadline)
+    return search.order, search.length()
+
+
+def improve_order(coordinates: np.ndarray, order: np.ndarray, max_segment_length: int = 3,
+                  two_opt: bool = True, neighbours: Optional[int] = None) -> Tuple[np.ndarray, float]:
+    """
+    Improve a path with Or-opt and 2-opt moves using delta evaluation and don't look bits
+    :param coordinates: Array with the x and y coordinate of each city
+    :param order: Indices of the cities in the order in which they are visited
+    :param max_segment_length: The longest segment that is moved by Or-opt
+    :param two_opt: Also apply 2-opt moves
+    :param neighbours: Only evaluate moves that connect a city to one of its k nearest neighbours, None for all moves
+    :return: The improved order and its length
+    """
+    candidates = None if neighbours is None else candidate_lists(coordinates, neighbours)
+    search = DeltaLocalSearch(coordinates, order, max_segment_length, two_opt, candidates)
+    search.run()
+    return search.order, search.length()
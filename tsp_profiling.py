@@ -0,0 +1,161 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import json
+import threading
+import time
+
+import tsp_general_functions
+from tsp_classes import City
+
+# The stats of the open profile() blocks of each thread or task, the innermost last
+_active_stats = ContextVar('active_stats', default=())
+# The counting versions of the hot paths are installed while any profile() block is open in any thread
+_install_lock = threading.Lock()
+_num_blocks = 0
+_originals = {}
+
+
+def current() -> Optional['SolverStats']:
+    """
+    The stats object of the innermost enclosing profile() block
+    :return: The stats or None when profiling is disabled, solvers check this once per iteration
+    """
+    active = _active_stats.get()
+    return active[-1] if active else None
+
+
+class SolverStats:
+    def __init__(self):
+        """
+        Counters, accumulated timers and a structured log of events, filled by the solvers inside a profile() block
+        """
+        self.counters = Counter()
+        self.timers = defaultdict(float)
+        self.events = []
+        self.t0 = time.perf_counter()
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Add the time spent in the block to the timer name
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] += time.perf_counter() - t0
+
+    def log(self, event: str, **fields):
+        """
+        Add an event to the structured log
+        :param event: Name of the event, e.g. 'grasp_iteration'
+        :param fields: Values to record with the event
+        """
+        self.events.append({'time': time.perf_counter() - self.t0, 'event': event, **fields})
+
+    def summary(self) -> dict:
+        return {'counters': dict(self.counters), 'timers': dict(self.timers), 'num_events': len(self.events)}
+
+    def write_log(self, file_name: str):
+        """
+        Write the events as JSON lines
+        :param file_name: The output file
+        """
+        with open(file_name, 'w') as file:
+            for event in self.events:
+                file.write(json.dumps(event, default=float) + '\n')
+
+    def __str__(self):
+        lines = [f'{name:>32} {value:12d}' for name, value in sorted(self.counters.items())]
+        lines += [f'{name:>32} {value:11.4f}s' for name, value in sorted(self.timers.items())]
+        return '\n'.join(lines)
+
+
+def _install():
+    """
+    Replace the hot paths by versions that count into the stats of the current profile() block
+    """
+    distance_to, city_hash = City.distance_to, City.__hash__
+    re_insert_path_segment = tsp_general_functions.re_insert_path_segment
+    re_insert_path_segment_length = tsp_general_functions.re_insert_path_segment_length
+    _originals.update(distance_to=distance_to, city_hash=city_hash, re_insert_path_segment=re_insert_path_segment,
+                      re_insert_path_segment_length=re_insert_path_segment_length)
+
+    def counted_distance_to(self, other):
+        stats = current()
+        if stats is not None:
+            stats.counters['distance_evaluations'] += 1
+        return distance_to(self, other)
+
+    def counted_hash(self):
+        stats = current()
+        if stats is not None:
+            stats.counters['city_hashes'] += 1
+        return city_hash(self)
+
+    def timed_re_insert_path_segment(*args, **kwargs):
+        stats = current()
+        if stats is None:
+            return re_insert_path_segment(*args, **kwargs)
+        stats.counters['re_insert_path_segment'] += 1
+        with stats.timer('re_insert_path_segment'):
+            return re_insert_path_segment(*args, **kwargs)
+
+    def counted_re_insert_path_segment_length(*args, **kwargs):
+        stats = current()
+        if stats is not None:
+            stats.counters['re_insert_path_segment_length'] += 1
+        return re_insert_path_segment_length(*args, **kwargs)
+
+    City.distance_to, City.__hash__ = counted_distance_to, counted_hash
+    tsp_general_functions.re_insert_path_segment = timed_re_insert_path_segment
+    tsp_general_functions.re_insert_path_segment_length = counted_re_insert_path_segment_length
+
+
+def _uninstall():
+    City.distance_to, City.__hash__ = _originals['distance_to'], _originals['city_hash']
+    tsp_general_functions.re_insert_path_segment = _originals['re_insert_path_segment']
+    tsp_general_functions.re_insert_path_segment_length = _originals['re_insert_path_segment_length']
+    _originals.clear()
+
+
+@contextmanager
+def profile(stats: Optional[SolverStats] = None):
+    """
+    Collect solver statistics within the block. The hot paths (City.distance_to, City.__hash__ and
+    re_insert_path_segment) are only replaced by counting versions while a block is open, once the last block of the
+    process is closed they run without any instrumentation again. Each thread and asyncio task reports to the stats
+    of its own innermost block, blocks may end in any order.
+    :param stats: The stats to add to, by default a new one
+    :return: The stats
+
+    Example:
+    with tsp_profiling.profile() as stats:
+        assignment2.local_search(cities)
+    print(stats)
+    """
+    global _num_blocks
+    if stats is None:
+        stats = SolverStats()
+    with _install_lock:
+        if _num_blocks == 0:
+            _install()
+        _num_blocks += 1
+    _active_stats.set(_active_stats.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        # Remove this block only, an overlapping block may have been opened after it and still be open
+        active = list(_active_stats.get())
+        if stats in active:
+            del active[len(active) - 1 - active[::-1].index(stats)]
+        _active_stats.set(tuple(active))
+        with _install_lock:
+            _num_blocks -= 1
+            if _num_blocks == 0:
+                _uninstall()
@@ -0,0 +1,541 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import AsyncIterator, Callable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+import asyncio
+import numpy as np
+import random
+import time
+
+import assignment1_solutions
+import assignment2
+import tsp_construction
+import tsp_exact
+import tsp_general_functions
+import tsp_local_search
+import tsp_profiling
+from tsp_classes import City, CityArray
+
+# From this number of cities on the GRASP construction queries its candidates from a spatial grid
+SPATIAL_INDEX_MIN_CITIES = 1000
+# Up to this number of cities solve() returns the optimal path of the Held-Karp solver, which takes well below 0.1 s
+EXACT_MAX_CITIES = 16
+
+
+def _solve_exactly(cities: List[City]) -> Tuple[List[City], float]:
+    """
+    Solve a small instance with tsp_exact.held_karp and check the result with evaluate_path
+    :return: The path and the objective
+    """
+    path, length, _ = tsp_exact.held_karp(cities)
+    evaluation = tsp_general_functions.evaluate_path(path, cities, length, verbose=False)
+    if not (evaluation.valid and evaluation.length_correct):
+        raise RuntimeError(f"held_karp returned a wrong solution: {evaluation.message}")
+    return path, length
+
+
+def solve(cities: List[City], time_limit: float = 1., callback: Optional[Callable[[float, float, str], None]] = None,
+          fraction_of_best: float = 1.2, neighbours: Optional[int] = 8, max_segment_length: int = 3,
+          seed: Optional[int] = None) -> Tuple[List[City], float, float]:
+    """
+    Anytime solver: repeat a GRASP construction (as in assignment2.grasp_nearest_neighbour) followed by the Or-opt
+    local search (as in assignment2.local_search with method='or_opt') until the time limit is reached.
+    The first construction always finishes, after that the best path found so far is returned when time is up.
+    Instances with at most EXACT_MAX_CITIES cities are solved to optimality with tsp_exact.held_karp instead.
+    :param cities: all cities to be visited
+    :param time_limit: The computation time in seconds
+    :param callback: Called as callback(seconds since the start, path length, phase) for every improvement of the best
+    path, where phase is 'construction', 'local_search' or 'exact'
+    :param fraction_of_best: The fraction for which cities are accepted in the GRASP construction
+    :param neighbours: Restrict the local search to the k nearest neighbours of each city, None for all moves
+    :param max_segment_length: The longest segment that is moved by the local search
+    :param seed: Seed of the GRASP construction
+    :return: The path, the objective, the computation time
+    """
+    t0 = time.time()
+    if len(cities) <= EXACT_MAX_CITIES:
+        path, length = _solve_exactly(cities)
+        if callback is not None:
+            callback(time.time() - t0, length, 'exact')
+        return path, length, time.time() - t0
+
+    deadline = t0 + time_limit
+    coordinates = CityArray.from_cities(cities).coordinates
+    rng = random.Random(seed)
+    spatial_index = len(cities) >= SPATIAL_INDEX_MIN_CITIES
+    candidates = None
+    if neighbours is not None and len(cities) > neighbours + 1:
+        candidates = tsp_local_search.candidate_lists(coordinates, neighbours)
+
+    best = {'order': None, 'length': np.inf}
+    stats = tsp_profiling.current()
+
+    # Lengths of improved paths are compared with the incremental length of the search, a path only counts as an
+    # improvement if it is shorter by more than the threshold of the search
+    def improvement(length: float, phase: str):
+        if length < best['length'] - tsp_local_search.IMPROVEMENT_THRESHOLD:
+            best['length'] = length
+            if callback is not None:
+                callback(time.time() - t0, float(length), phase)
+
+    while True:
+        t_round = time.time()
+        order, length = assignment2.grasp_order(coordinates, fraction_of_best, rng, spatial_index)
+        t_construction = time.time() - t_round
+        if stats is not None:
+            stats.count('grasp_iterations')
+            stats.timers['construction'] += t_construction
+            stats.log('grasp_iteration', length=length, seconds=t_construction)
+        if length < best['length'] - tsp_local_search.IMPROVEMENT_THRESHOLD:
+            best['order'] = order
+            improvement(length, 'construction')
+        if time.time() >= deadline:
+            break
+
+        search = tsp_local_search.DeltaLocalSearch(coordinates, order, max_segment_length, neighbours=candidates)
+        search.run(deadline=deadline, callback=lambda length: improvement(length, 'local_search'))
+        if stats is not None:
+            stats.timers['improvement'] += time.time() - t_round - t_construction
+        if search.current_length <= best['length']:
+            # The best length was already reported during the search
+            best['order'] = search.order.copy()
+        if time.time() >= deadline:
+            break
+
+    path = [cities[index] for index in np.asarray(best['order']).tolist()]
+    return path, tsp_general_functions.tour_length(coordinates, best['order']), time.time() - t0
+
+
+def reoptimize(path: List[City], inserted: Sequence[City] = (), removed: Sequence[City] = (),
+               neighbours: int = 8, max_segment_length: int = 3,
+               time_limit: Optional[float] = None) -> Tuple[List[City], float, float]:
+    """
+    Update a solved path after a few cities were added or removed: removed cities are cut out, inserted cities are
+    placed on the arc next to one of their nearest cities where they add the least length and the Or-opt local search
+    is run from the cities around the changes only. The work grows with the size of the change instead of the instance.
+    :param path: The path before the change
+    :param inserted: The cities to add
+    :param removed: The cities of path to drop
+    :param neighbours: The local search only evaluates moves that connect a city to one of its k nearest neighbours
+    :param max_segment_length: The longest segment that is moved by the local search
+    :param time_limit: Stop the local search after this many seconds, None to run until no city improves
+    :return: The path, the objective, the computation time
+    """
+    t0 = time.time()
+    removed = set(removed)
+    kept = []
+    # Indices in kept of the cities next to a removed city, their arcs changed
+    affected = []
+    for index, city in enumerate(path):
+        if city in removed:
+            affected.extend((len(kept) - 1, len(kept)))
+        else:
+            kept.append(city)
+    cities = kept + list(inserted)
+    num_cities = len(cities)
+    if num_cities == 0:
+        return [], 0., time.time() - t0
+    # A removed first or last city affects the kept city at the other end of the path
+    affected = np.asarray(affected, dtype=np.intp) % len(kept) if kept else np.empty(0, dtype=np.intp)
+
+    coordinates = CityArray.from_cities(cities).coordinates
+    new_cities = np.arange(len(kept), num_cities)
+    order = tsp_construction.insert_cities(coordinates, np.arange(len(kept)), new_cities, neighbours)
+    if num_cities < 5:
+        return [cities[index] for index in order.tolist()], tsp_general_functions.tour_length(coordinates, order), \
+               time.time() - t0
+
+    search = tsp_local_search.LazyCandidateSearch(coordinates, order, max_segment_length, k=neighbours)
+    active = np.unique(np.concatenate((affected, new_cities)))
+    deadline = None if time_limit is None else t0 + time_limit
+    search.run(active=active.tolist(), deadline=deadline)
+    return [cities[index] for index in search.order.tolist()], search.length(), time.time() - t0
+
+
+def grasp_local_search(cities: List[City], grasp_iterations: int = 1, fraction_of_best: float = 1.2,
+                       neighbours: Optional[int] = 8, max_segment_length: int = 3,
+                       seed: Optional[int] = None) -> Tuple[List[City], float, float]:
+    """
+    Quick solver for many small instances: the best of a few GRASP constructions (as in solve) improved once by the
+    Or-opt and 2-opt local search, all on coordinate arrays. Instances with at most EXACT_MAX_CITIES cities are solved
+    to optimality with tsp_exact.held_karp instead.
+    :param cities: all cities to be visited
+    :param grasp_iterations: The number of GRASP constructions
+    :param fraction_of_best: The fraction for which cities are accepted in the GRASP construction
+    :param neighbours: Restrict the local search to the k nearest neighbours of each city, None for all moves
+    :param max_segment_length: The longest segment that is moved by the local search
+    :param seed: Seed of the GRASP construction
+    :return: The path, the objective, the computation time
+    """
+    t0 = time.time()
+    if len(cities) <= EXACT_MAX_CITIES:
+        path, length = _solve_exactly(cities)
+        return path, length, time.time() - t0
+
+    coordinates = CityArray.from_cities(cities).coordinates
+    rng = random.Random(seed)
+    spatial_index = len(cities) >= SPATIAL_INDEX_MIN_CITIES
+    best_order, best_length = None, np.inf
+    for _ in range(grasp_iterations):
+        order, length = assignment2.grasp_order(coordinates, fraction_of_best, rng, spatial_index)
+        if length < best_length:
+            best_order, best_length = order, length
+
+    candidates = None
+    if neighbours is not None and len(cities) > neighbours + 1:
+        candidates = tsp_local_search.candidate_lists(coordinates, neighbours)
+    search = tsp_local_search.DeltaLocalSearch(coordinates, best_order, max_segment_length, neighbours=candidates)
+    search.run()
+    return [cities[index] for index in search.order.tolist()], \
+        tsp_general_functions.tour_length(coordinates, search.order), time.time() - t0
+
+
+class BatchResult(NamedTuple):
+    index: int
+    order: np.ndarray
+    length: float
+    comp_time: float
+
+
+def _batch_solvers() -> dict:
+    return {
+        'initial_solution': assignment1_solutions.initial_solution,
+        'local_search': assignment2.local_search,
+        'held_karp': tsp_exact.held_karp,
+        'solve': solve,
+        'grasp_local_search': grasp_local_search,
+    }
+
+
+# Batch solvers that take a seed, the others draw from the random module
+_SEEDED_BATCH_SOLVERS = ('solve', 'grasp_local_search')
+
+
+def _solve_batch(solver: str, parameters: dict, batch: List[Tuple[int, np.ndarray, int]]) -> List[BatchResult]:
+    """
+    Solve a batch of instances in a worker process
+    :param solver: Name of the solver in _batch_solvers()
+    :param parameters: Keyword arguments of the solver
+    :param batch: The index, coordinates and seed of each instance
+    :return: The result of each instance, with the order as compact indices
+    """
+    results = []
+    for index, coordinates, seed in batch:
+        cities = CityArray(coordinates)
+        if solver in _SEEDED_BATCH_SOLVERS:
+            path, length, comp_time = _batch_solvers()[solver](cities, seed=seed, **parameters)
+        else:
+            # Seed the random module for this instance only, such that the result does not depend on which worker
+            # solved it or on what that worker solved before
+            state = random.getstate()
+            random.seed(seed)
+            try:
+                path, length, comp_time = _batch_solvers()[solver](cities, **parameters)
+            finally:
+                random.setstate(state)
+        order = tsp_general_functions.path_indices(path, cities).astype(np.int32)
+        results.append(BatchResult(index, order, float(length), comp_time))
+    return results
+
+
+def _batch_parameters(solver: str, parameters: dict) -> dict:
+    """
+    Keyword arguments of a batch solver. Without any, local_search runs the Or-opt search on 8 nearest neighbours
+    instead of its default exhaustive search, which is far too slow to solve many instances
+    """
+    if solver == 'local_search' and not parameters:
+        return {'method': 'or_opt', 'neighbours': 8}
+    return parameters
+
+
+def _instance_seed(entropy: int, index: int) -> int:
+    """
+    Independent seed of the instance at index in a call of solve_many, derived with a numpy SeedSequence
+    """
+    return int(np.random.SeedSequence(entropy, spawn_key=(index,)).generate_state(1)[0])
+
+
+def _instance_coordinates(instance) -> np.ndarray:
+    coordinates = instance if isinstance(instance, np.ndarray) else CityArray.from_cities(instance).coordinates
+    return np.ascontiguousarray(coordinates, dtype=np.float64)
+
+
+class BatchSolver:
+    def __init__(self, processes: Optional[int] = None):
+        """
+        Solve many small instances on a pool of worker processes that stays alive between calls, such that the
+        workers only pay their start up once. Instances are sent to the workers as coordinate arrays, in batches.
+        :param processes: The number of worker processes, by default the number of CPUs. With 1 the instances are
+        solved in this process
+        """
+        self.processes = processes
+        self.executor = None if processes == 1 else ProcessPoolExecutor(max_workers=processes)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _submit(self, instances, solver: str, batch_size: int, parameters: dict, entropy: int):
+        batch = []
+        for index, instance in enumerate(instances):
+            batch.append((index, _instance_coordinates(instance), _instance_seed(entropy, index)))
+            if len(batch) == batch_size:
+                yield self.executor.submit(_solve_batch, solver, parameters, batch)
+                batch = []
+        if batch:
+            yield self.executor.submit(_solve_batch, solver, parameters, batch)
+
+    def solve_many(self, instances, solver: str = 'grasp_local_search', batch_size: int = 16,
+                   seed: Optional[int] = None, **parameters) -> Iterator[BatchResult]:
+        """
+        Solve instances and yield the results as they complete, which is not necessarily the order of instances
+        :param instances: Iterable of instances, each a coordinate array, a CityArray or a list of cities
+        :param solver: 'grasp_local_search', 'initial_solution', 'local_search', 'held_karp' or 'solve'
+        :param batch_size: The number of instances sent to a worker at once
+        :param seed: Each instance gets its own seed derived from this one and its position in instances, so the
+        results do not depend on the number of workers. None for a fresh seed
+        :param parameters: Keyword arguments of the solver, without any local_search uses the 'or_opt' method with 8
+        neighbours
+        :return: Iterator over the results, BatchResult.index is the position of the instance in instances
+        """
+        if solver not in _batch_solvers():
+            raise ValueError(f"Unknown solver {solver}, use one of {', '.join(_batch_solvers())}")
+        parameters = _batch_parameters(solver, parameters)
+        entropy = np.random.SeedSequence(seed).entropy
+        if self.executor is None:
+            for index, instance in enumerate(instances):
+                yield from _solve_batch(solver, parameters,
+                                        [(index, _instance_coordinates(instance), _instance_seed(entropy, index))])
+            return
+        futures = list(self._submit(instances, solver, batch_size, parameters, entropy))
+        for future in as_completed(futures):
+            yield from future.result()
+
+    async def solve_many_async(self, instances, solver: str = 'grasp_local_search', batch_size: int = 16,
+                               seed: Optional[int] = None, **parameters) -> AsyncIterator[BatchResult]:
+        """
+        Asynchronous version of solve_many, the event loop keeps running while the workers solve
+        """
+        if solver not in _batch_solvers():
+            raise ValueError(f"Unknown solver {solver}, use one of {', '.join(_batch_solvers())}")
+        parameters = _batch_parameters(solver, parameters)
+        entropy = np.random.SeedSequence(seed).entropy
+        if self.executor is None:
+            # Without worker processes the instances are solved one by one in a thread of the default executor
+            loop = asyncio.get_running_loop()
+            for index, instance in enumerate(instances):
+                batch = [(index, _instance_coordinates(instance), _instance_seed(entropy, index))]
+                for result in await loop.run_in_executor(None, _solve_batch, solver, parameters, batch):
+                    yield result
+            return
+        futures = [asyncio.wrap_future(future)
+                   for future in self._submit(instances, solver, batch_size, parameters, entropy)]
+        for future in asyncio.as_completed(futures):
+            for result in await future:
+                yield result
+
+
+# The pool of solve_many and solve_partitioned, created on its first call
+_batch_solver = None
+
+
+def shared_batch_solver(processes: Optional[int] = None) -> BatchSolver:
+    """
+    The pool that solve_many and solve_partitioned share, it is kept alive between calls
+    :param processes: The number of worker processes, a different number than in the previous call starts a new pool
+    :return: The batch solver
+    """
+    global _batch_solver
+    if _batch_solver is None or _batch_solver.processes != processes:
+        if _batch_solver is not None:
+            _batch_solver.close()
+        _batch_solver = BatchSolver(processes)
+    return _batch_solver
+
+
+def solve_many(instances, solver: str = 'grasp_local_search', processes: Optional[int] = None, batch_size: int = 16,
+               seed: Optional[int] = None, **parameters) -> Iterator[BatchResult]:
+    """
+    Solve many instances on a shared pool of worker processes that is kept alive between calls, see BatchSolver
+    :param instances: Iterable of instances, each a coordinate array, a CityArray or a list of cities
+    :param solver: 'grasp_local_search', 'initial_solution', 'local_search', 'held_karp' or 'solve'
+    :param processes: The number of worker processes, a different number than in the previous call starts a new pool
+    :param batch_size: The number of instances sent to a worker at once
+    :param seed: Seed from which the seed of each instance is derived
+    :param parameters: Keyword arguments of the solver, without any local_search uses the 'or_opt' method with 8
+    neighbours
+    :return: Iterator over the results as they complete
+    """
+    return shared_batch_solver(processes).solve_many(instances, solver, batch_size, seed, **parameters)
+
+
+def _grid_partition(coordinates: np.ndarray, num_clusters: int, margin: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Divide the cities over square grid cells
+    :return: The cluster of each city and whether the city lies within margin of the border of its cell
+    """
+    low, high = coordinates.min(axis=0), coordinates.max(axis=0)
+    size = np.maximum(high - low, 1e-9)
+    # As in SpatialGrid, such that instances on a line still get about num_clusters cells
+    cell_size = max(np.sqrt(size[0] * size[1] / num_clusters), size[0] / num_clusters, size[1] / num_clusters)
+    num_x, num_y = np.maximum(np.ceil(size / cell_size).astype(int), 1)
+    cell = np.minimum(((coordinates - low) // cell_size).astype(np.intp), (num_x - 1, num_y - 1))
+    # Distance to the nearest border between two cells
+    offset = coordinates - low - cell * cell_size
+    to_border = np.minimum(np.where(cell > 0, offset, np.inf),
+                           np.where(cell < (num_x - 1, num_y - 1), cell_size - offset, np.inf)).min(axis=1)
+    return cell[:, 0] * num_y + cell[:, 1], to_border < margin
+
+
+def _kmeans_partition(coordinates: np.ndarray, num_clusters: int, margin: float, iterations: int = 10,
+                      seed: Optional[int] = None, block_size: int = 2 ** 22) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Divide the cities with Lloyd's k-means algorithm, distances to the centres are computed in blocks of cities
+    :return: The cluster of each city and whether the city lies within margin of the border with another cluster
+    """
+    rng = np.random.default_rng(seed)
+    centres = coordinates[rng.choice(len(coordinates), num_clusters, replace=False)]
+    rows_per_block = max(1, block_size // num_clusters)
+    cluster = np.empty(len(coordinates), dtype=np.intp)
+    boundary = np.empty(len(coordinates), dtype=bool)
+    for iteration in range(iterations + 1):
+        for block in range(0, len(coordinates), rows_per_block):
+            points = coordinates[block: block + rows_per_block]
+            distances = np.sqrt(((points[:, np.newaxis, :] - centres[np.newaxis, :, :]) ** 2).sum(axis=2))
+            nearest_two = np.partition(distances, 1, axis=1)[:, :2] if num_clusters > 1 else \
+                np.hstack((distances, np.full_like(distances, np.inf)))
+            cluster[block: block + rows_per_block] = np.argmin(distances, axis=1)
+            # Half the difference of the distances to the two nearest centres bounds the distance to their border
+            boundary[block: block + rows_per_block] = (nearest_two[:, 1] - nearest_two[:, 0]) / 2 < margin
+        if iteration == iterations:
+            break
+        counts = np.bincount(cluster, minlength=num_clusters)
+        sums = np.stack([np.bincount(cluster, coordinates[:, axis], num_clusters) for axis in range(2)], axis=1)
+        # Empty clusters keep their centre
+        centres = np.where(counts[:, np.newaxis] > 0, sums / np.maximum(counts, 1)[:, np.newaxis], centres)
+    return cluster, boundary
+
+
+def _merge_cycles(coordinates: np.ndarray, next_city: np.ndarray, previous_cities: np.ndarray, cities: np.ndarray,
+                  num_candidates: int) -> List[int]:
+    """
+    Merge the cycle of a cluster into the tour with the cheapest exchange of an arc of the previous cluster and an arc
+    of the new one: a1-a2 and b1-b2 become a1-b2 and b1-a2, or a1-b1 and b2-a2 with the new cycle reversed
+    :param next_city: The successor of each city, for the tour built so far and for the cycle of the new cluster
+    :param previous_cities: The cities of the previous cluster, which are on the tour
+    :param cities: The cities of the new cluster
+    :param num_candidates: The number of cities of each cluster closest to the other cluster that are tried
+    :return: The cities whose arcs changed
+    """
+    def distances(cities1, cities2):
+        return np.sqrt(((coordinates[cities1] - coordinates[cities2]) ** 2).sum(axis=-1))
+
+    def closest(candidates, other):
+        to_centre = np.sqrt(((coordinates[candidates] - coordinates[other].mean(axis=0)) ** 2).sum(axis=1))
+        return candidates[np.argsort(to_centre)[:num_candidates]]
+
+    a1 = closest(previous_cities, cities)[:, np.newaxis]
+    b1 = closest(cities, previous_cities)[np.newaxis, :]
+    a2, b2 = next_city[a1], next_city[b1]
+    removed = distances(a1, a2) + distances(b1, b2)
+    keep = distances(a1, b2) + distances(b1, a2) - removed
+    reverse = distances(a1, b1) + distances(b2, a2) - removed
+    if keep.min() <= reverse.min():
+        row, column = np.unravel_index(np.argmin(keep), keep.shape)
+        a1, a2, b1, b2 = int(a1[row, 0]), int(a2[row, 0]), int(b1[0, column]), int(b2[0, column])
+        next_city[a1], next_city[b1] = b2, a2
+    else:
+        row, column = np.unravel_index(np.argmin(reverse), reverse.shape)
+        a1, a2, b1, b2 = int(a1[row, 0]), int(a2[row, 0]), int(b1[0, column]), int(b2[0, column])
+        # Reverse the cycle of the new cluster, then enter it at b1 and leave it at b2
+        successors = next_city[cities]
+        next_city[successors] = cities
+        next_city[a1], next_city[b2] = b1, a2
+    return [a1, a2, b1, b2]
+
+
+def solve_partitioned(cities: List[City], cluster_size: int = 200, partition: str = 'grid',
+                      solver: str = 'local_search', processes: Optional[int] = None, neighbours: int = 8,
+                      boundary_margin: float = 1., seed: Optional[int] = None,
+                      batch_solver: Optional[BatchSolver] = None, **parameters) -> Tuple[List[City], float, float]:
+    """
+    Divide and conquer for very large instances: partition the cities into spatial clusters, solve the clusters
+    independently on a pool of worker processes, merge the cycles of the clusters one after the other with the
+    cheapest arc exchange and finish with an Or-opt and 2-opt pass that starts from the cities near the borders
+    between clusters and at the merges. Instances with at most EXACT_MAX_CITIES cities are solved exactly.
+    :param cities: all cities to be visited
+    :param cluster_size: The average number of cities per cluster
+    :param partition: 'grid' for square cells or 'kmeans' for k-means clusters (which costs time in proportion to
+    the number of cities times the number of clusters)
+    :param solver: The solver of each cluster, 'initial_solution', 'local_search' or 'solve'
+    :param processes: The number of worker processes of the shared pool of solve_many, by default the number of CPUs
+    :param neighbours: The number of candidate neighbours in the final improvement pass
+    :param boundary_margin: Cities within this many times the average distance between neighbouring cities of the
+    border of their cluster start the final improvement pass
+    :param seed: Seed of the k-means initialisation and of the solvers of the clusters
+    :param batch_solver: Solve the clusters on this pool instead of the shared pool (processes is then not used)
+    :param parameters: Keyword arguments of the solver, by default local_search uses the 'or_opt' method with 8
+    neighbours after one GRASP iteration
+    :return: The path, the objective, the computation time
+    """
+    t0 = time.time()
+    coordinates = np.asarray(CityArray.from_cities(cities).coordinates, dtype=np.float64)
+    num_cities = len(coordinates)
+    if solver == 'local_search' and not parameters:
+        parameters = {'method': 'or_opt', 'neighbours': 8, 'grasp_iterations': 1}
+    if num_cities <= EXACT_MAX_CITIES:
+        path, length = _solve_exactly(cities)
+        return path, length, time.time() - t0
+
+    num_clusters = max(1, int(np.ceil(num_cities / cluster_size)))
+    low, high = coordinates.min(axis=0), coordinates.max(axis=0)
+    spacing = np.sqrt(max((high - low).prod(), 1e-9) / num_cities)
+    if partition == 'grid':
+        cluster, boundary = _grid_partition(coordinates, num_clusters, boundary_margin * spacing)
+    elif partition == 'kmeans':
+        cluster, boundary = _kmeans_partition(coordinates, num_clusters, boundary_margin * spacing, seed=seed)
+    else:
+        raise ValueError(f"Unknown partition {partition}, use 'grid' or 'kmeans'")
+    members = np.argsort(cluster, kind='stable')
+    counts = np.bincount(cluster)
+    clusters = [part for part in np.split(members, np.cumsum(counts)[:-1]) if len(part) > 0]
+
+    # Solve the clusters, small ones exactly in this process and the others on the pool
+    next_city = np.empty(num_cities, dtype=np.intp)
+    large = []
+    for index, part in enumerate(clusters):
+        if len(part) >= 8:
+            large.append(index)
+        else:
+            order, _ = tsp_exact.held_karp_order(coordinates[part])
+            next_city[part[order]] = np.roll(part[order], -1)
+    if batch_solver is None:
+        batch_solver = shared_batch_solver(processes)
+    for result in batch_solver.solve_many([coordinates[clusters[index]] for index in large], solver, 1, seed,
+                                          **parameters):
+        part = clusters[large[result.index]][result.order]
+        next_city[part] = np.roll(part, -1)
+
+    # Merge the clusters in the order of a tour along their centres, such that consecutive clusters are close
+    centres = np.array([coordinates[part].mean(axis=0) for part in clusters])
+    sequence = tsp_construction.nearest_neighbour_order(centres,
+                                                        spatial_index=len(clusters) >= SPATIAL_INDEX_MIN_CITIES)
+    merged = []
+    for previous, index in zip(sequence[:-1].tolist(), sequence[1:].tolist()):
+        merged.extend(_merge_cycles(coordinates, next_city, clusters[previous], clusters[index], 32))
+
+    order = np.empty(num_cities, dtype=np.intp)
+    city = 0
+    for position in range(num_cities):
+        order[position] = city
+        city = next_city[city]
+
+    search = tsp_local_search.LazyCandidateSearch(coordinates, order, k=neighbours)
+    active = np.unique(np.concatenate((np.flatnonzero(boundary), np.asarray(merged, dtype=np.intp))))
+    search.run(active=active.tolist())
+    return [cities[index] for index in search.order.tolist()], search.length(), time.time() - t0
@@ -0,0 +1,189 @@
+from typing import Tuple, Optional, Sequence
+import numpy as np
+
+from tsp_classes import City, CityArray
+
+
+class SpatialGrid:
+    def __init__(self, cities: Sequence[City], bounds: Optional[Tuple[float, float, float, float]] = None,
+                 cities_per_cell: float = 2.0):
+        """
+        Uniform grid over the city coordinates that answers nearest city and radius queries among the cities that
+        have not been removed yet. Removing visited cities keeps the queries local, such that constructing a path
+        takes close to O(n log n) instead of scanning all unvisited cities at every step.
+        :param cities: All cities of the instance, a list of cities or a CityArray. Query results are indices into it
+        :param bounds: (min_x, min_y, max_x, max_y) of the canvas, e.g. (0, 0, MAX_X, MAX_Y) from start_up.
+        If None the bounding box of the cities is used
+        :param cities_per_cell: The average number of cities per grid cell
+        """
+        self.cities = cities
+        self.coordinates = np.asarray(CityArray.from_cities(cities).coordinates, dtype=np.float64)
+        self.x = self.coordinates[:, 0]
+        self.y = self.coordinates[:, 1]
+        if bounds is None:
+            if len(self.coordinates) > 0:
+                bounds = (self.x.min(), self.y.min(), self.x.max(), self.y.max())
+            else:
+                bounds = (0., 0., 0., 0.)
+        self.bounds = bounds
+        self.cities_per_cell = cities_per_cell
+        self.alive = np.ones(len(self.coordinates), dtype=bool)
+        self.num_alive = len(self.coordinates)
+        # The number of distances computed by the queries, reported by the solvers when profiling
+        self.distance_evaluations = 0
+        self._build(np.arange(len(self.coordinates)))
+
+    def _build(self, indices: np.ndarray):
+        """
+        Divide the given cities over square cells, such that each cell holds cities_per_cell cities on average
+        :param indices: Indices of the cities to store in the grid
+        """
+        min_x, min_y, max_x, max_y = self.bounds
+        width = max(max_x - min_x, 1e-9)
+        height = max(max_y - min_y, 1e-9)
+        num_cells = max(1., len(indices) / self.cities_per_cell)
+        self.cell_size = max(np.sqrt(width * height / num_cells), width / num_cells, height / num_cells)
+        self.num_x = int(np.ceil(width / self.cell_size)) or 1
+        self.num_y = int(np.ceil(height / self.cell_size)) or 1
+
+        cell_x = np.clip(((self.x[indices] - min_x) // self.cell_size).astype(np.intp), 0, self.num_x - 1)
+        cell_y = np.clip(((self.y[indices] - min_y) // self.cell_size).astype(np.intp), 0, self.num_y - 1)
+        self.cell_of = np.full(len(self.coordinates), -1, dtype=np.intp)
+        self.cell_of[indices] = cell_x * self.num_y + cell_y
+
+        # Stable sort keeps the indices ascending within each cell
+        sorted_indices = indices[np.argsort(self.cell_of[indices], kind='stable')]
+        counts = np.bincount(self.cell_of[indices], minlength=self.num_x * self.num_y)
+        self.cells = [cell.tolist() for cell in np.split(sorted_indices, np.cumsum(counts)[:-1])]
+
+    def __len__(self):
+        return self.num_alive
+
+    def __contains__(self, index: int):
+        return bool(self.alive[index])
+
+    def remove(self, index: int):
+        """
+        Remove a city from the grid, e.g. because it is visited
+        :param index: Index of the city to remove
+        """
+        if not self.alive[index]:
+            return
+        self.alive[index] = False
+        self.num_alive -= 1
+        self.cells[self.cell_of[index]].remove(index)
+        if 0 < self.num_alive < len(self.cells) * self.cities_per_cell / 4:
+            # Most cells are empty by now, use larger cells such that queries do not scan long rings of empty cells
+            self._build(np.flatnonzero(self.alive))
+
+    def add(self, index: int):
+        """
+        Add a city to the grid, e.g. because it is inserted into a path
+        :param index: Index of the city to add
+        """
+        if self.alive[index]:
+            return
+        self.alive[index] = True
+        self.num_alive += 1
+        if self.num_alive > len(self.cells) * self.cities_per_cell * 4:
+            # The cells hold many more cities than they were sized for, use smaller cells
+            self._build(np.flatnonzero(self.alive))
+            return
+        cell_x, cell_y = self._cell(self.x[index], self.y[index])
+        self.cell_of[index] = cell_x * self.num_y + cell_y
+        self.cells[self.cell_of[index]].append(index)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        min_x, min_y, _, _ = self.bounds
+        cell_x = min(max(int((x - min_x) // self.cell_size), 0), self.num_x - 1)
+        cell_y = min(max(int((y - min_y) // self.cell_size), 0), self.num_y - 1)
+        return cell_x, cell_y
+
+    def _ring(self, cell_x: int, cell_y: int, ring: int) -> list:
+        """
+        Collect the cities in the cells at Chebyshev distance ring from a cell
+        """
+        if ring == 0:
+            return list(self.cells[cell_x * self.num_y + cell_y])
+        indices = []
+        x_low, x_high = cell_x - ring, cell_x + ring
+        y_low, y_high = max(cell_y - ring, 0), min(cell_y + ring, self.num_y - 1)
+        for column in (x_low, x_high):
+            if 0 <= column < self.num_x:
+                for row in range(y_low, y_high + 1):
+                    indices.extend(self.cells[column * self.num_y + row])
+        for row in (cell_y - ring, cell_y + ring):
+            if 0 <= row < self.num_y:
+                for column in range(max(x_low + 1, 0), min(x_high - 1, self.num_x - 1) + 1):
+                    indices.extend(self.cells[column * self.num_y + row])
+        return indices
+
+    def _distances(self, x: float, y: float, indices) -> np.ndarray:
+        indices = np.asarray(indices, dtype=np.intp)
+        self.distance_evaluations += len(indices)
+        return np.sqrt((self.x[indices] - x) ** 2 + (self.y[indices] - y) ** 2)
+
+    def nearest(self, x: float, y: float, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest cities that are still in the grid
+        :param x: x coordinate of the query point
+        :param y: y coordinate of the query point
+        :param k: The number of cities to return
+        :return: Indices of the nearest cities and their distances, sorted on distance and on index for ties
+        """
+        k = min(k, self.num_alive)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        min_x, min_y, _, _ = self.bounds
+        cell_x, cell_y = self._cell(x, y)
+        candidates = []
+        ring = 0
+        while True:
+            candidates.extend(self._ring(cell_x, cell_y, ring))
+            # Distance from the query point to the cells outside the rings searched so far, no cities lie beyond
+            # the border of the grid
+            margins = [np.inf]
+            if cell_x - ring > 0:
+                margins.append(x - (min_x + (cell_x - ring) * self.cell_size))
+            if cell_x + ring < self.num_x - 1:
+                margins.append(min_x + (cell_x + ring + 1) * self.cell_size - x)
+            if cell_y - ring > 0:
+                margins.append(y - (min_y + (cell_y - ring) * self.cell_size))
+            if cell_y + ring < self.num_y - 1:
+                margins.append(min_y + (cell_y + ring + 1) * self.cell_size - y)
+            unexplored_distance = min(margins)
+            if len(candidates) >= k:
+                distances = self._distances(x, y, candidates)
+                # Strictly smaller such that ties with unexplored cities are resolved on index as well
+                if np.partition(distances, k - 1)[k - 1] < unexplored_distance:
+                    break
+            if unexplored_distance == np.inf:
+                distances = self._distances(x, y, candidates)
+                break
+            ring += 1
+
+        candidates = np.asarray(candidates, dtype=np.intp)
+        best = np.lexsort((candidates, distances))[:k]
+        return candidates[best], distances[best]
+
+    def within(self, x: float, y: float, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find all cities that are still in the grid within a radius of a point
+        :param x: x coordinate of the query point
+        :param y: y coordinate of the query point
+        :param radius: Cities at a distance of at most radius are returned
+        :return: Indices of the cities and their distances, sorted on index
+        """
+        if np.isfinite(radius):
+            low_x, low_y = self._cell(x - radius, y - radius)
+            high_x, high_y = self._cell(x + radius, y + radius)
+        else:
+            low_x, low_y, high_x, high_y = 0, 0, self.num_x - 1, self.num_y - 1
+        candidates = []
+        for column in range(low_x, high_x + 1):
+            for row in range(low_y, high_y + 1):
+                candidates.extend(self.cells[column * self.num_y + row])
+        candidates = np.sort(np.asarray(candidates, dtype=np.intp))
+        distances = self._distances(x, y, candidates)
+        inside = distances <= radius
+        return candidates[inside], distances[inside]